@@ -0,0 +1,32 @@
+-- nvim side of the output writer of rplugin/python3/jupyter_nvim/writer.py
+local M = {}
+
+-- write one block of lines to every target buffer in a single request.
+-- targets: list of {buf, start, base, trim}. The lines replace the buffer
+-- from line `start` (-1 to append, -2 to replace the open last line),
+-- `base` is the row of the first line, used for the highlights
+-- {row, start_col, end_col, group}. Then the first `trim` lines are
+-- deleted. Returns {buf, trimmed lines} for the trimmed buffers.
+function M.deliver(lines, targets, highlights)
+  local ns = nil
+  if #highlights > 0 then
+    ns = vim.api.nvim_create_namespace('jupyter_nvim_ansi')
+  end
+  local trimmed = {}
+  for _, target in ipairs(targets) do
+    local buf, start, base, trim = target[1], target[2], target[3], target[4]
+    if vim.api.nvim_buf_is_valid(buf) then
+      vim.api.nvim_buf_set_lines(buf, start, -1, false, lines)
+      for _, hl in ipairs(highlights) do
+        vim.api.nvim_buf_set_extmark(buf, ns, base + hl[1], hl[2], {end_col = hl[3], hl_group = hl[4]})
+      end
+      if trim > 0 then
+        table.insert(trimmed, {buf, vim.api.nvim_buf_get_lines(buf, 0, trim, false)})
+        vim.api.nvim_buf_set_lines(buf, 0, trim, false, {})
+      end
+    end
+  end
+  return trimmed
+end
+
+return M
@@ -8,3 +8,130 @@ command! -nargs=+ -range -bang Jupyter call Jupyter({
       \ 'mods':  <q-mods>}, <q-args>)
 
 nmap <leader>E :<c-u>exe printf(".,+%dJupyter run", v:count1-1)<cr>
+
+" colors of terminal escape sequences, used when ansi_highlight is enabled
+let s:ansi_colors = [
+      \ ['Black', '#000000'], ['DarkRed', '#cd0000'], ['DarkGreen', '#00cd00'], ['DarkYellow', '#cdcd00'],
+      \ ['DarkBlue', '#0000ee'], ['DarkMagenta', '#cd00cd'], ['DarkCyan', '#00cdcd'], ['LightGray', '#e5e5e5'],
+      \ ['DarkGray', '#7f7f7f'], ['Red', '#ff0000'], ['Green', '#00ff00'], ['Yellow', '#ffff00'],
+      \ ['Blue', '#5c5cff'], ['Magenta', '#ff00ff'], ['Cyan', '#00ffff'], ['White', '#ffffff']]
+for s:i in range(16)
+  exe printf('highlight default JupyterAnsi%d ctermfg=%s guifg=%s',
+        \ s:i < 8 ? 30 + s:i : 82 + s:i, s:ansi_colors[s:i][0], s:ansi_colors[s:i][1])
+endfor
+highlight default JupyterAnsiBold cterm=bold gui=bold
+
+" set the quickfix list of a child app. The list with id a:id is replaced
+" if it still exists, otherwise a new list is created. Returns the list id
+function! JupyterSetQfList(id, title, items) abort
+  if a:id && getqflist({'id': a:id}).id == a:id
+    call setqflist([], 'r', {'id': a:id, 'title': a:title, 'items': a:items})
+    return a:id
+  endif
+  call setqflist([], ' ', {'title': a:title, 'items': a:items})
+  return getqflist({'id': 0}).id
+endfunction
+
+" omnifunc completing from the kernel of the current child app, e.g.
+" setlocal omnifunc=JupyterOmniFunc. A reply that misses the time budget
+" of the omnifunc pops up later through JupyterCompleteDone
+function! JupyterOmniFunc(findstart, base) abort
+  if a:findstart
+    let s:complete = JupyterComplete(strpart(getline('.'), 0, col('.') - 1))
+    return empty(s:complete) ? -3 : s:complete.start
+  endif
+  return empty(s:complete) ? [] : s:complete.words
+endfunction
+
+" shows a completion reply if the text before the cursor has not changed
+function! JupyterCompleteDone(prefix, result) abort
+  if mode() ==# 'i' && strpart(getline('.'), 0, col('.') - 1) ==# a:prefix
+    call complete(a:result.start + 1, a:result.words)
+  endif
+endfunction
+
+" with g:jupyter_nvim_autocomplete set, completion is requested while typing
+augroup jupyter_nvim_complete
+  autocmd!
+  autocmd TextChangedI * if get(g:, 'jupyter_nvim_autocomplete', 0) && !pumvisible()
+        \ | call JupyterCompleteAsync(strpart(getline('.'), 0, col('.') - 1)) | endif
+augroup END
+
+" the variable explorer of a child app, filled by ':Jupyter vars'. <cr>
+" shows the variable under the cursor, ]p and [p page through it and -
+" goes back to the list
+function! JupyterShowVars(childid, lines, name, page) abort
+  let l:bufname = printf('jupyter://vars/%s', a:childid)
+  let l:winid = bufwinid(l:bufname)
+  if l:winid == -1
+    exe 'botright split' fnameescape(l:bufname)
+    setlocal buftype=nofile bufhidden=hide noswapfile nobuflisted nowrap filetype=jupytervars
+    nnoremap <buffer> <silent> <cr> :<c-u>call <sid>vars_open()<cr>
+    nnoremap <buffer> <silent> ]p :<c-u>call <sid>vars_show(b:jupyter_vars.name, b:jupyter_vars.page + v:count1)<cr>
+    nnoremap <buffer> <silent> [p :<c-u>call <sid>vars_show(b:jupyter_vars.name, b:jupyter_vars.page - v:count1)<cr>
+    nnoremap <buffer> <silent> - :<c-u>call <sid>vars_show('', 0)<cr>
+  else
+    call win_gotoid(l:winid)
+  endif
+  let b:jupyter_vars = {'childid': a:childid, 'name': a:name, 'page': a:page}
+  let l:header = empty(a:name) ? [] : [printf('# %s, page %d', a:name, a:page + 1)]
+  setlocal modifiable
+  silent %delete _
+  call setline(1, l:header + a:lines)
+  setlocal nomodifiable
+endfunction
+
+function! s:vars_open() abort
+  " the first line of the list is its header
+  if empty(b:jupyter_vars.name) && line('.') > 1
+    call s:vars_show(matchstr(getline('.'), '^\S\+'), 0)
+  endif
+endfunction
+
+function! s:vars_show(name, page) abort
+  let l:args = ['vars', '-n', '' . b:jupyter_vars.childid]
+  if a:name !=# ''
+    let l:args += [a:name, '--page', string(max([a:page, 0]))]
+  endif
+  call call('Jupyter', l:args)
+endfunction
+
+" notebook buffers opened by ':Jupyter notebook open' are written by :w
+augroup jupyter_nvim_notebook
+  autocmd!
+  autocmd BufWriteCmd jupyter://notebook/* call JupyterNotebookSave(
+        \ getbufvar(+expand('<abuf>'), 'jupyter_notebook_child'), +expand('<abuf>'))
+augroup END
+
+" the executions recorded by a child app, filled by ':Jupyter history'. ]p
+" and [p page through older and newer ones
+function! JupyterShowHistory(childid, lines, options, page) abort
+  let l:bufname = printf('jupyter://history/%s', a:childid)
+  let l:winid = bufwinid(l:bufname)
+  if l:winid == -1
+    exe 'botright split' fnameescape(l:bufname)
+    setlocal buftype=nofile bufhidden=hide noswapfile nobuflisted filetype=python
+    nnoremap <buffer> <silent> ]p :<c-u>call <sid>history_show(b:jupyter_history.page + v:count1)<cr>
+    nnoremap <buffer> <silent> [p :<c-u>call <sid>history_show(b:jupyter_history.page - v:count1)<cr>
+  else
+    call win_gotoid(l:winid)
+  endif
+  let b:jupyter_history = {'childid': a:childid, 'options': a:options, 'page': a:page}
+  let l:header = [printf('# history, page %d%s', a:page + 1, empty(a:lines) ? ', no more executions' : '')]
+  setlocal modifiable
+  silent %delete _
+  call setline(1, l:header + a:lines)
+  setlocal nomodifiable
+endfunction
+
+function! s:history_show(page) abort
+  let l:options = b:jupyter_history.options
+  let l:args = ['history', '-n', '' . b:jupyter_history.childid, '--page', string(max([a:page, 0]))]
+  if l:options.session
+    let l:args += ['--session']
+  endif
+  if l:options.count !=# ''
+    let l:args += ['--count', string(l:options.count)]
+  endif
+  call call('Jupyter', l:args + l:options.query)
+endfunction
@@ -2,16 +2,11 @@
 version_info = (0, 1, 0)
 __version__ = '.'.join(map(str, version_info[:3])) + ''.join(version_info[3:])
 
-import os
+# this module is loaded by the remote plugin host on every nvim startup.
+# Keep it light: the jupyter stack is imported by jupyter_nvim.command on
+# the first ':Jupyter' call
 import neovim
 import logging
-import argparse, io
-import traceback
-import shlex
-from jupyter_nvim.nvimapp import (
-    JupyterNvimBufferApp,
-    JupyterNvimApp,
-)
 
 logger = logging.getLogger(__name__)
 # if 'JUPYTER_NVIM_LOGFILE' in os.environ:
@@ -19,72 +14,31 @@ logger = logging.getLogger(__name__)
 #     logger.addHandler(logging.FileHandler(logfile, 'w'))
 #     logger.level = logging.DEBUG
 
-class HelpActionHandled(Exception):
-    pass
-
-class PrintHelpAction(argparse._HelpAction):
-    def __call__(self, parser, namespace, values, option_string=None):
-        file = io.StringIO()
-        parser.print_help(file=file)
-        raise HelpActionHandled(file.getvalue())
+def __getattr__(name):
+    if name in ('JupyterNvimBufferApp', 'JupyterNvimApp'):
+        from jupyter_nvim import nvimapp
+        return getattr(nvimapp, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 @neovim.plugin
 # @neovim.encoding(True)
 class TestPlugin(object):
     def __init__(self, nvim):
         self.nvim = nvim
-        self.app = None
+        self.command = None
         self.log = logger
         self.log.info('Plugin initialized')
-        self._init_arg_parser()
-
-    def _init_arg_parser(self):
-        def add_help(parser):
-            parser.add_argument('-h', '--help', action=PrintHelpAction, default=argparse.SUPPRESS,
-                                help='show this help message and exit')
-
-        self.parser = argparse.ArgumentParser(add_help=False)
-        add_help(self.parser)
-        subparsers = self.parser.add_subparsers()
-
-        def add_parser(name, **kwargs):
-            require_childid = kwargs.pop('require_childid', False)
-            allow_unknown = kwargs.pop('allow_unknown', False)
-
-            subparser = subparsers.add_parser(name, add_help=False, **kwargs)
-            add_help(subparser)
-            subparser.set_defaults(subcommand=name)
-
-            def check_unknown(unknowns):
-                if not allow_unknown and unknowns:
-                    raise ValueError('Unknown options {}'.format(unknowns))
-            subparser.set_defaults(check_unknown=check_unknown)
 
-            if require_childid is not None:
-                subparser.add_argument('-n', '--name', required=False, help='childid, child app identity', dest='childid')
-            return subparser
-
-        init = add_parser('init', help='initialize main app', require_childid=None)
-
-        quit = add_parser('quit', help='quit main app', require_childid=None)
-        quit.add_argument('childid', nargs='*', help='if has positional args, quit those child apps. Otherwise, quit all child apps')
-
-        start = add_parser('start', help='start subapp', require_childid=True)
-        start.add_argument('app_argv', nargs='*', help='argv for subapp')
-        start.add_argument('--out', '-o', action='append', help='out buffer')
-        start.add_argument('--inout', '--io', '-i', action='append', help='inout buffer')
-
-        execute = add_parser('execute', help='execute code')
-        execute.add_argument('code', nargs='+', help='code')
-
-        run = add_parser('run', help='run code, specified by range')
+    @property
+    def app(self):
+        if self.command is not None:
+            return self.command.app
 
     @neovim.command('JupyterTestCommand', nargs="*", range=True)
     def testcommand(self, args, range):
         message = 'Command with args: {}, range: {}'.format(args, range)
         self.nvim.current.line = message
         logger.info(message)
-        # self.zerorpc.print(message)
 
     @neovim.function('JupyterTestFunction', sync=True)
     def testsyncfunction(self, args):
@@ -97,83 +51,49 @@ class TestPlugin(object):
     def testfunction(self, args):
         logger.info('test async nested function {}'.format(args))
 
-    def initialize(self):
+    # notified by the autocmds defined by JupyterNvimApp.watch_buffers once
+    # the app is started. Autocmds of the plugin would start the python
+    # host at the first buffer event of every session
+    @neovim.rpc_export('jupyter_nvim_buf_add', sync=False)
+    def on_buf_add(self, bufno):
+        if self.app is not None:
+            self.app.on_buf_add(int(bufno))
+
+    @neovim.rpc_export('jupyter_nvim_buf_delete', sync=False)
+    def on_buf_delete(self, bufno):
+        if self.app is not None:
+            self.app.on_buf_delete(int(bufno))
+
+    # completion from the kernel of the current child app, see JupyterOmniFunc
+    @neovim.function('JupyterComplete', sync=True)
+    def complete(self, args):
         if self.app is None:
-            self.app = JupyterNvimApp()
-            self.app.initialize(self.nvim, [])
-            self.log = self.app.log
-            self.log.info('App started')
+            return {}
+        return self.app.complete(args[0])
+
+    @neovim.function('JupyterCompleteAsync', sync=False)
+    def complete_async(self, args):
+        if self.app is not None:
+            self.app.complete_async(args[0])
+
+    # BufWriteCmd of notebook buffers. Sync, so that the file is written and
+    # 'modified' reset before :w returns, for :wq and :x
+    @neovim.function('JupyterNotebookSave', sync=True)
+    def notebook_save(self, args):
+        childid, bufno = args
+        if self.command is None or self.app is None:
+            raise ValueError('no notebook is open')
+        self.command.save_notebook(childid, self.nvim.buffers[int(bufno)])
 
     @neovim.function('Jupyter', sync=False)
     def main(self, raw_args):
-        self.initialize()
-        if isinstance(raw_args[0], dict):
-            options = raw_args.pop(0)
-        else:
-            options = {}
-        cbuf = self.nvim.current.buffer
-        from_commandline = options.get('cmd', False)
-        if from_commandline:
-            cooked_args = []
-            for arg in raw_args:
-                cooked_args.extend(shlex.split(arg))
-        else:
-            cooked_args = raw_args
-
-        self.log.info('%s: %s', options, cooked_args)
-
-        try:
-            args, unknown = self.parser.parse_known_args(cooked_args)
-            args.check_unknown(unknown)
-            if args.subcommand == 'init':
-                pass
-            elif args.subcommand == 'quit':
-                if args.childid:
-                    for childid in args.childid:
-                        if childid in self.app:
-                            self.app.quit_app(childid)
-                            self.log.info('quit child app %s', childid)
-                        else:
-                            self.log.error('childid %s does not exist', childid)
-                else:
-                    self.quit()
-                    self.log.info('quit all child apps and reset main app')
-            elif args.subcommand == 'start':
-                bufapp = self.app.start_child_app(args.childid, args.app_argv)
-                has_buffer = False
-                if args.out:
-                    has_buffer = bufapp.register_out_buffer(*args.out) or has_buffer
-                if args.inout:
-                    has_buffer = bufapp.register_inout_buffer(*args.inout) or has_buffer
-                if not has_buffer:
-                    bufapp.register_out_buffer(cbuf.number)
-                self.log.info('subapp started')
-            elif args.subcommand == 'execute':
-                code = '\n'.join(args.code)
-                self.app('execute', code, args.childid)
-                self.log.info('execute %s', code)
-            elif args.subcommand == 'run':
-                line1 = options.get('line1')
-                line2 = options.get('line2')
-                self.app('execute', '\n'.join(cbuf[line1-1:line2]))
-
-        except HelpActionHandled as ex:
-            self.echo(str(ex))
-        except Exception as ex:
-            buf = io.StringIO()
-            traceback.print_exc(limit=None, file=buf)
-            self.log.error('parse args error %s:\n%s', cooked_args, buf.getvalue())
-
-    def echo(self, msg):
-        self.nvim.vars['jupyter_nvim_msg'] = msg
-        self.nvim.command('echo jupyter_nvim_msg')
+        if self.command is None:
+            from jupyter_nvim.command import JupyterCommand
+            self.command = JupyterCommand(self.nvim, self.log)
+        self.command(raw_args)
+        self.log = self.command.log
 
     @neovim.shutdown_hook
     def shutdown_hook(self):
-        self.quit()
-
-    def quit(self):
-        if self.app:
-            self.app.quit()
-            self.app = None
-        self.log.info('quit app ...')
+        if self.command is not None:
+            self.command.quit()
@@ -0,0 +1,315 @@
+import asyncio
+import threading
+import zmq
+import zmq.asyncio
+from traitlets import Type
+from jupyter_client import KernelClient
+
+__all__ = (
+    'get_loop',
+    'AsyncioZMQSocketChannel',
+    'AsyncioHBChannel',
+    'AsyncioKernelClient',
+)
+
+# all the asyncio kernel clients share one event loop, run in one thread,
+# instead of an ioloop thread and a heartbeat thread per kernel
+_loop = None
+_loop_lock = threading.Lock()
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_run_loop, args=(_loop,),
+                                      name='jupyter-nvim-asyncio', daemon=True)
+            thread.start()
+        return _loop
+
+def _shadow(socket):
+    # an asyncio socket sharing the zmq socket of a blocking one. Created in
+    # the loop thread so that it is bound to the shared loop
+    return zmq.asyncio.Socket.shadow(socket.underlying)
+
+class AsyncioZMQSocketChannel():
+    '''A channel of an AsyncioKernelClient, with the interface of
+    jupyter_client's ThreadedZMQSocketChannel.
+
+    ``call_handlers`` is called in the loop thread for each message. It
+    passes the message to ``handler``, set by
+    ``AsyncioKernelClient.set_handlers``; messages received before are kept
+    until then. Subclasses may override it instead.
+    '''
+    session = None
+    socket = None
+    ioloop = None
+    _inspect = None
+
+    def __init__(self, socket, session, loop=None):
+        self.session = session
+        self.ioloop = loop or get_loop()
+        # the blocking socket owns the zmq socket, it must outlive the shadow
+        self._socket = socket
+        self._task = None
+        self._is_alive = False
+        self.handler = None
+        self._early = []
+
+    def _async_socket(self):
+        if self.socket is None:
+            self.socket = _shadow(self._socket)
+        return self.socket
+
+    def is_alive(self):
+        return self._is_alive
+
+    def start(self):
+        self._is_alive = True
+        self.ioloop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        self._task = self.ioloop.create_task(self._recv_loop())
+
+    async def _recv_loop(self):
+        socket = self._async_socket()
+        while self._is_alive:
+            try:
+                parts = await socket.recv_multipart()
+            except asyncio.CancelledError:
+                break
+            except zmq.ZMQError:
+                if not self._is_alive:
+                    break
+                raise
+            try:
+                self._handle_recv(parts)
+            except Exception as ex:
+                self.ioloop.call_exception_handler({
+                    'message': 'failed to handle a kernel message',
+                    'exception': ex,
+                })
+
+    def _handle_recv(self, parts):
+        ident, smsg = self.session.feed_identities(parts)
+        msg = self.session.deserialize(smsg)
+        # let client inspect messages
+        if self._inspect:
+            self._inspect(msg)
+        self.call_handlers(msg)
+
+    def call_handlers(self, msg):
+        if self.handler is None:
+            self._early.append(msg)
+        else:
+            self.handler(msg)
+
+    def set_handler(self, handler):
+        # called in the loop thread
+        self.handler = handler
+        early, self._early = self._early, []
+        for msg in early:
+            handler(msg)
+
+    def stop(self):
+        # there is no thread to join, the socket is closed with the channel
+        self._is_alive = False
+        self.ioloop.call_soon_threadsafe(self._close)
+
+    def close(self):
+        self.ioloop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._socket is not None:
+            try:
+                self._socket.close(linger=0)
+            except Exception:
+                pass
+            self._socket = None
+            self.socket = None
+
+    def send(self, msg):
+        # thread safe, the message is sent from the loop thread
+        self.ioloop.call_soon_threadsafe(self._send, msg)
+
+    def _send(self, msg):
+        self.session.send(self._async_socket(), msg)
+
+    def process_events(self):
+        pass
+
+    def flush(self, timeout=1.0):
+        # wait until the messages queued in the socket have been handled
+        future = asyncio.run_coroutine_threadsafe(self._flush(), self.ioloop)
+        try:
+            future.result(timeout)
+        except Exception:
+            future.cancel()
+
+    async def _flush(self):
+        socket = self._async_socket()
+        while socket.get(zmq.EVENTS) & zmq.POLLIN:
+            await asyncio.sleep(0)
+
+class AsyncioHBChannel():
+    '''The heartbeat channel of an AsyncioKernelClient, with the interface
+    of jupyter_client's HBChannel.
+
+    The kernel is pinged from a task of the shared loop. ``call_handlers``
+    gets the seconds since the last heartbeat when the kernel does not
+    answer within ``time_to_dead``.
+    '''
+    time_to_dead = 1.
+
+    def __init__(self, context=None, session=None, address=None, loop=None):
+        self.context = context
+        self.session = session
+        if isinstance(address, tuple):
+            address = 'tcp://%s:%i' % address
+        self.address = address
+        self.ioloop = loop or get_loop()
+        self.socket = None
+        self._socket = None
+        self._task = None
+        self._running = False
+        self._pause = False
+        self._beating = False
+        self._wake = None
+        self.handler = None
+
+    def _create_socket(self):
+        self._close_socket()
+        self._socket = self.context.socket(zmq.REQ)
+        self._socket.linger = 1000
+        self._socket.connect(self.address)
+        self.socket = _shadow(self._socket)
+
+    def _close_socket(self):
+        if self._socket is not None:
+            try:
+                self._socket.close(linger=0)
+            except Exception:
+                pass
+            self._socket = None
+            self.socket = None
+
+    def is_alive(self):
+        return self._running
+
+    def start(self):
+        self._running = True
+        self._beating = True
+        self.ioloop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        self._wake = asyncio.Event()
+        self._task = self.ioloop.create_task(self._beat())
+
+    async def _sleep(self, seconds):
+        # an early stop wakes the loop up
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _beat(self):
+        loop = self.ioloop
+        while self._running:
+            if self._pause:
+                await self._sleep(self.time_to_dead)
+                continue
+            if self.socket is None:
+                self._create_socket()
+            self.socket.send(b'ping')
+            request_time = loop.time()
+            if await self.socket.poll(1000 * self.time_to_dead):
+                self._beating = True
+                await self.socket.recv()
+                remainder = self.time_to_dead - (loop.time() - request_time)
+                if remainder > 0:
+                    await self._sleep(remainder)
+            else:
+                # close and reopen the socket, the REQ/REP cycle is broken
+                self._beating = False
+                self._close_socket()
+                try:
+                    self.call_handlers(loop.time() - request_time)
+                except Exception as ex:
+                    loop.call_exception_handler({
+                        'message': 'failed to handle a heartbeat failure',
+                        'exception': ex,
+                    })
+        self._close_socket()
+
+    def pause(self):
+        self._pause = True
+
+    def unpause(self):
+        self._pause = False
+
+    def is_beating(self):
+        return self._running and not self._pause and self._beating
+
+    def stop(self):
+        self._running = False
+        self.ioloop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def close(self):
+        self.stop()
+
+    def call_handlers(self, since_last_heartbeat):
+        if self.handler is not None:
+            self.handler(since_last_heartbeat)
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+class AsyncioKernelClient(KernelClient):
+    '''A KernelClient whose channels run on the event loop shared by all
+    asyncio clients, see ``get_loop``.
+
+    Like ThreadedKernelClient, messages are handled in the loop thread.
+    ``set_handlers(shell=f, iopub=g, ...)`` sets the function called with
+    the messages of each channel.
+    '''
+
+    @property
+    def ioloop(self):
+        return get_loop()
+
+    def start_channels(self, shell=True, iopub=True, stdin=True, hb=True):
+        if shell:
+            self.shell_channel._inspect = self._check_kernel_info_reply
+        super(AsyncioKernelClient, self).start_channels(shell, iopub, stdin, hb)
+
+    def _check_kernel_info_reply(self, msg):
+        # run in the loop thread when the kernel info reply is received
+        if msg['msg_type'] == 'kernel_info_reply':
+            self._handle_kernel_info_reply(msg)
+            self.shell_channel._inspect = None
+
+    def set_handlers(self, **handlers):
+        channels = {
+            'shell': self.shell_channel,
+            'iopub': self.iopub_channel,
+            'stdin': self.stdin_channel,
+            'hb': self.hb_channel,
+        }
+        for name, handler in handlers.items():
+            self.ioloop.call_soon_threadsafe(channels[name].set_handler, handler)
+
+    iopub_channel_class = Type(AsyncioZMQSocketChannel)
+    shell_channel_class = Type(AsyncioZMQSocketChannel)
+    stdin_channel_class = Type(AsyncioZMQSocketChannel)
+    hb_channel_class = Type(AsyncioHBChannel)
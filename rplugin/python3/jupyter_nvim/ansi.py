@@ -0,0 +1,90 @@
+import re
+from functools import lru_cache
+
+__all__ = (
+    'strip_ansi',
+    'ansi_highlights',
+)
+
+# CSI sequences (colors, cursor movement, erasing, ...), OSC sequences
+# (window titles, hyperlinks) and the two character escape sequences
+_escape = re.compile(
+    r'\x1b(?:\[[0-?]*[ -/]*[@-~]'
+    r'|\][^\x07\x1b]*(?:\x07|\x1b\\)?'
+    r'|[ -/]*[0-~])'
+)
+
+def strip_ansi(text):
+    if '\x1b' not in text:
+        return text
+    return _escape.sub('', text)
+
+_groups = {code: 'JupyterAnsi{}'.format(code) for code in list(range(30, 38)) + list(range(90, 98))}
+
+@lru_cache(maxsize=256)
+def _apply_sgr(params, fg, bold):
+    codes = [int(code) if code else 0 for code in params.split(';')] if params else [0]
+    ii = 0
+    while ii < len(codes):
+        code = codes[ii]
+        if code == 0:
+            fg, bold = None, False
+        elif code == 1:
+            bold = True
+        elif code == 22:
+            bold = False
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            fg = code
+        elif code == 39:
+            fg = None
+        elif code in (38, 48):
+            # extended colors, 38;5;n or 38;2;r;g;b, are not mapped
+            if ii + 1 < len(codes):
+                ii += 2 if codes[ii+1] == 5 else 4 if codes[ii+1] == 2 else 0
+        ii += 1
+    return fg, bold
+
+def ansi_highlights(lines):
+    '''Strip the escape sequences of ``lines`` and turn their colors into
+    highlights.
+
+    Returns the stripped lines and a list of ``(row, start_col, end_col,
+    group)``, with byte columns as nvim expects them. The groups are
+    JupyterAnsi30-37, JupyterAnsi90-97 and JupyterAnsiBold.
+    '''
+    stripped = []
+    highlights = []
+    fg, bold = None, False
+
+    def add(row, col, text):
+        end = col + (len(text) if text.isascii() else len(text.encode()))
+        if fg is not None:
+            highlights.append((row, col, end, _groups[fg]))
+        if bold:
+            highlights.append((row, col, end, 'JupyterAnsiBold'))
+        return end
+
+    for row, line in enumerate(lines):
+        if '\x1b' not in line:
+            stripped.append(line)
+            if line and (fg is not None or bold):
+                add(row, 0, line)
+            continue
+        parts = []
+        col = 0
+        pos = 0
+        for match in _escape.finditer(line):
+            text = line[pos:match.start()]
+            if text:
+                col = add(row, col, text)
+                parts.append(text)
+            sequence = match.group()
+            if sequence[-1] == 'm' and sequence[1] == '[':
+                fg, bold = _apply_sgr(sequence[2:-1], fg, bold)
+            pos = match.end()
+        text = line[pos:]
+        if text:
+            add(row, col, text)
+            parts.append(text)
+        stripped.append(''.join(parts))
+    return stripped, highlights
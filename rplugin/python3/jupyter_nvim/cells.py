@@ -0,0 +1,23 @@
+import re
+
+__all__ = (
+    'split_cells',
+)
+
+_cell_marker = re.compile(r'^\s*#\s*%%')
+
+def split_cells(lines):
+    '''Split lines into the code of the cells delimited by ``# %%`` markers.
+
+    The marker lines are dropped, and so are cells with only blank lines.
+    '''
+    cells = []
+    cell = []
+    for line in lines:
+        if _cell_marker.match(line):
+            cells.append(cell)
+            cell = []
+        else:
+            cell.append(line)
+    cells.append(cell)
+    return ['\n'.join(cell) for cell in cells if any(line.strip() for line in cell)]
@@ -0,0 +1,336 @@
+import io
+import os
+import json
+import shlex
+import argparse
+import traceback
+from collections import OrderedDict
+from jupyter_nvim.nvimapp import JupyterNvimApp
+from jupyter_nvim.stats import format_stats
+
+__all__ = (
+    'JupyterCommand',
+)
+
+class HelpActionHandled(Exception):
+    pass
+
+class PrintHelpAction(argparse._HelpAction):
+    def __call__(self, parser, namespace, values, option_string=None):
+        file = io.StringIO()
+        parser.print_help(file=file)
+        raise HelpActionHandled(file.getvalue())
+
+def _no_unknown(unknowns):
+    pass
+
+# characters that make shlex.split differ from str.split
+_SHELL_CHARS = frozenset('"\'\\')
+
+def _split(arg):
+    if _SHELL_CHARS.isdisjoint(arg):
+        return arg.split()
+    return shlex.split(arg)
+
+def _fast_parse(cooked_args):
+    # the Namespace argparse makes of a run or execute command line, None
+    # for anything else, which is left to argparse
+    if not cooked_args or cooked_args[0] not in ('run', 'execute'):
+        return None
+    subcommand = cooked_args[0]
+    args = argparse.Namespace(subcommand=subcommand, check_unknown=_no_unknown, childid=None)
+    words = []
+    if subcommand == 'run':
+        args.cells = False
+    it = iter(cooked_args[1:])
+    for arg in it:
+        if arg in ('-n', '--name'):
+            args.childid = next(it, None)
+            # argparse takes no option as the value of -n
+            if args.childid is None or args.childid.startswith('-'):
+                return None
+        elif arg.startswith('--name='):
+            args.childid = arg[len('--name='):]
+        elif subcommand == 'run' and arg in ('-c', '--cells'):
+            args.cells = True
+        elif arg.startswith('-'):
+            return None
+        elif subcommand == 'execute':
+            words.append(arg)
+        else:
+            return None
+    if subcommand == 'execute':
+        if not words:
+            return None
+        args.code = words
+    return args
+
+class JupyterCommand(object):
+    # the ':Jupyter' command. Imported on its first call, so that the
+    # jupyter stack is only loaded by sessions that use it
+    def __init__(self, nvim, log, parse_cache_size=256):
+        self.nvim = nvim
+        self.app = None
+        self.log = log
+        self.parse_cache_size = parse_cache_size
+        # cooked args -> Namespace
+        self._parsed = OrderedDict()
+        self._init_arg_parser()
+
+    def _init_arg_parser(self):
+        def add_help(parser):
+            parser.add_argument('-h', '--help', action=PrintHelpAction, default=argparse.SUPPRESS,
+                                help='show this help message and exit')
+
+        self.parser = argparse.ArgumentParser(add_help=False)
+        add_help(self.parser)
+        subparsers = self.parser.add_subparsers()
+
+        def add_parser(name, **kwargs):
+            require_childid = kwargs.pop('require_childid', False)
+            allow_unknown = kwargs.pop('allow_unknown', False)
+
+            subparser = subparsers.add_parser(name, add_help=False, **kwargs)
+            add_help(subparser)
+            subparser.set_defaults(subcommand=name)
+
+            def check_unknown(unknowns):
+                if not allow_unknown and unknowns:
+                    raise ValueError('Unknown options {}'.format(unknowns))
+            subparser.set_defaults(check_unknown=check_unknown)
+
+            if require_childid is not None:
+                subparser.add_argument('-n', '--name', required=False, help='childid, child app identity', dest='childid')
+            return subparser
+
+        init = add_parser('init', help='initialize main app', require_childid=None)
+
+        quit = add_parser('quit', help='quit main app', require_childid=None)
+        quit.add_argument('childid', nargs='*', help='if has positional args, quit those child apps. Otherwise, quit all child apps')
+
+        start = add_parser('start', help='start subapp', require_childid=True)
+        start.add_argument('app_argv', nargs='*', help='argv for subapp')
+        start.add_argument('--out', '-o', action='append', type=int, help='out buffer')
+        start.add_argument('--inout', '--io', '-i', action='append', type=int, help='inout buffer')
+        start.add_argument('--max-lines', type=int, dest='max_lines',
+                           help='line cap of the out buffers, the oldest cells are trimmed into the spill file')
+
+        execute = add_parser('execute', help='execute code')
+        execute.add_argument('code', nargs='+', help='code')
+
+        run = add_parser('run', help='run code, specified by range')
+        run.add_argument('--cells', '-c', action='store_true',
+                         help='split the range into cells at "# %%" markers and execute them one by one')
+
+        cancel = add_parser('cancel', help='drop the executions waiting in the queue')
+        cancel.add_argument('--interrupt', '-i', action='store_true', help='also interrupt the running execution')
+
+        interrupt = add_parser('interrupt', help='drop the queued executions and interrupt the kernel')
+
+        inspect = add_parser('inspect', help='show the documentation of the object under the cursor')
+        inspect.add_argument('--detail', '-d', action='count', default=0, help='detail level, -d for the source')
+
+        variables = add_parser('vars', help='list the variables of the kernel, or show a page of one')
+        variables.add_argument('variable', nargs='?', help='variable to show')
+        variables.add_argument('--page', '-p', type=int, default=0, help='page of the variable, from 0')
+
+        notebook = add_parser('notebook', help='open a .ipynb notebook as a buffer of "# %%" cells, '
+                                               'save it or run the cell under the cursor')
+        notebook.add_argument('action', choices=['open', 'save', 'run'])
+        notebook.add_argument('path', nargs='?', help='notebook to open')
+        notebook.add_argument('--buffer', '-b', type=int, help='notebook buffer, the current buffer by default')
+
+        history = add_parser('history', help='page through the executed code and its results, newest first')
+        history.add_argument('query', nargs='*', help='words the code contains')
+        history.add_argument('--page', '-p', type=int, default=0, help='page, from 0')
+        history.add_argument('--session', '-s', action='store_true', help='only the current session of the kernel')
+        history.add_argument('--count', '-c', type=int, help='execution count')
+
+        spill = add_parser('spill', help='open the lines trimmed from the out buffers')
+
+        stats = add_parser('stats', help='show message rates, latencies, handler times and the nvim call queue')
+        stats.add_argument('--json', nargs='?', const='', default=None, metavar='FILE',
+                           help='dump the stats as JSON, into FILE if given')
+
+    def initialize(self):
+        if self.app is None:
+            self.app = JupyterNvimApp()
+            self.app.initialize(self.nvim, [])
+            self.log = self.app.log
+            self.log.info('App started')
+
+    def cook(self, raw_args, from_commandline=False):
+        if from_commandline:
+            cooked_args = []
+            for arg in raw_args:
+                cooked_args.extend(_split(arg))
+            return cooked_args
+        return list(raw_args)
+
+    def parse(self, cooked_args):
+        '''Returns the Namespace of a command line.
+
+        The command lines of mappings repeat, so the results are cached,
+        unless some argument is not a string. run and execute, the commands
+        of the mappings, are parsed without argparse, which is left for the
+        other commands and for -h.
+        '''
+        key = None
+        if all(isinstance(arg, str) for arg in cooked_args):
+            key = tuple(cooked_args)
+            args = self._parsed.get(key)
+            if args is not None:
+                self._parsed.move_to_end(key)
+                return args
+        args = _fast_parse(cooked_args)
+        if args is None:
+            args, unknown = self.parser.parse_known_args(cooked_args)
+            args.check_unknown(unknown)
+        if key is not None:
+            self._parsed[key] = args
+            if len(self._parsed) > self.parse_cache_size:
+                self._parsed.popitem(last=False)
+        return args
+
+    def __call__(self, raw_args):
+        self.initialize()
+        if isinstance(raw_args[0], dict):
+            options = raw_args.pop(0)
+        else:
+            options = {}
+        cbuf = self.nvim.current.buffer
+        from_commandline = options.get('cmd', False)
+        cooked_args = self.cook(raw_args, from_commandline)
+
+        self.log.info('%s: %s', options, cooked_args)
+
+        try:
+            args = self.parse(cooked_args)
+            if args.subcommand == 'init':
+                pass
+            elif args.subcommand == 'quit':
+                if args.childid:
+                    for childid in args.childid:
+                        if childid in self.app:
+                            self.app.quit_app(childid)
+                            self.log.info('quit child app %s', childid)
+                        else:
+                            self.log.error('childid %s does not exist', childid)
+                else:
+                    self.quit()
+                    self.log.info('quit all child apps and reset main app')
+            elif args.subcommand == 'start':
+                bufapp = self.app.start_child_app(args.childid, args.app_argv)
+                has_buffer = False
+                if args.out:
+                    has_buffer = bufapp.register_out_buffer(*args.out, max_lines=args.max_lines) or has_buffer
+                if args.inout:
+                    has_buffer = bufapp.register_inout_buffer(*args.inout) or has_buffer
+                if not has_buffer:
+                    bufapp.register_out_buffer(cbuf.number, max_lines=args.max_lines)
+                self.log.info('subapp started')
+            elif args.subcommand == 'execute':
+                code = '\n'.join(args.code)
+                self.app.child_app(args.childid).submit(code)
+                self.log.info('execute %s', code)
+            elif args.subcommand in ('cancel', 'interrupt'):
+                interrupt = args.subcommand == 'interrupt' or args.interrupt
+                count = self.app.child_app(args.childid).cancel(interrupt=interrupt)
+                self.echo('{} queued executions cancelled'.format(count))
+            elif args.subcommand == 'run':
+                line1 = options.get('line1')
+                line2 = options.get('line2')
+                lines = cbuf.api.get_lines(line1-1, line2, False)
+                self.app.child_app(args.childid).run_lines(lines, cells=args.cells)
+            elif args.subcommand == 'inspect':
+                line = self.nvim.current.line
+                col = self.nvim.current.window.cursor[1]
+                # the kernel counts unicode characters, nvim counts bytes
+                cursor_pos = len(line.encode()[:col].decode(errors='ignore'))
+                self.app.child_app(args.childid).inspect(line, cursor_pos=cursor_pos,
+                                                         detail_level=min(args.detail, 1))
+            elif args.subcommand == 'vars':
+                self.app.child_app(args.childid).explorer.request(args.variable, max(args.page, 0))
+            elif args.subcommand == 'notebook':
+                self.notebook(args, cbuf)
+            elif args.subcommand == 'history':
+                bufapp = self.app.child_app(args.childid)
+                if bufapp.history_store is None:
+                    self.echo('the history is disabled')
+                else:
+                    query = ' '.join(args.query)
+                    page = max(args.page, 0)
+                    lines = bufapp.show_history(query, page, current_session=args.session,
+                                                execution_count=args.count)
+                    options = {'query': args.query, 'session': args.session, 'count': args.count or ''}
+                    self.nvim.call('JupyterShowHistory', str(bufapp.childid),
+                                   lines, options, page)
+            elif args.subcommand == 'spill':
+                bufapp = self.app.child_app(args.childid)
+                if bufapp.spill.path is None:
+                    self.echo('nothing has been trimmed')
+                else:
+                    self.nvim.command('sview ' + self.nvim.funcs.fnameescape(bufapp.spill.path))
+            elif args.subcommand == 'stats':
+                stats = self.app.stats(args.childid)
+                if args.json is None:
+                    lines = []
+                    for childid, app_stats in sorted(stats.items()):
+                        lines.extend(format_stats(childid, app_stats))
+                    self.echo('\n'.join(lines) or 'no child app')
+                elif args.json:
+                    with open(args.json, 'w') as f:
+                        json.dump(stats, f, indent=2, sort_keys=True)
+                    self.echo('stats written to {}'.format(args.json))
+                else:
+                    self.echo(json.dumps(stats, sort_keys=True))
+
+        except HelpActionHandled as ex:
+            self.echo(str(ex))
+        except Exception as ex:
+            buf = io.StringIO()
+            traceback.print_exc(limit=None, file=buf)
+            self.log.error('parse args error %s:\n%s', cooked_args, buf.getvalue())
+
+    def notebook(self, args, cbuf):
+        bufapp = self.app.child_app(args.childid)
+        if args.action == 'open':
+            if not args.path:
+                raise ValueError('notebook open needs the path of the notebook')
+            path = os.path.abspath(os.path.expanduser(args.path))
+            self.nvim.command('edit ' + self.nvim.funcs.fnameescape('jupyter://notebook/' + path))
+            buf = self.nvim.current.buffer
+            notebook = bufapp.open_notebook(path, buf)
+            # written by the BufWriteCmd autocmd of plugin/jupyter.vim
+            buf.options['buftype'] = 'acwrite'
+            buf.options['swapfile'] = False
+            buf.options['filetype'] = 'python'
+            buf.options['modified'] = False
+            buf.vars['jupyter_notebook_child'] = str(bufapp.childid)
+            self.echo('{}: {} cells'.format(path, len(notebook.cells)))
+            return
+        buf = cbuf
+        if args.buffer is not None:
+            buf = self.nvim.buffers[args.buffer]
+        if buf.number not in bufapp.notebooks:
+            raise ValueError('buffer {} is not a notebook of child app {}'.format(buf.number, args.childid))
+        if args.action == 'save':
+            self.save_notebook(args.childid, buf)
+        else:
+            bufapp.run_notebook_cell(buf, self.nvim.current.window.cursor[0] - 1)
+
+    def save_notebook(self, childid, buf):
+        # also called by JupyterNotebookSave, for :w of a notebook buffer
+        notebook = self.app.child_app(childid).save_notebook(buf)
+        buf.options['modified'] = False
+        self.echo('{} written'.format(notebook.path))
+
+    def echo(self, msg):
+        self.nvim.vars['jupyter_nvim_msg'] = msg
+        self.nvim.command('echo jupyter_nvim_msg')
+
+    def quit(self):
+        if self.app:
+            self.app.quit()
+            self.app = None
+        self.log.info('quit app ...')
@@ -0,0 +1,147 @@
+import threading
+from collections import OrderedDict
+
+__all__ = (
+    'Completer',
+)
+
+class Completer():
+    '''Completion from the kernel's complete_request.
+
+    ``send(code, cursor_pos)`` sends a complete_request and returns its
+    msgid, ``cancel(msgid)`` stops tracking a request that has been
+    superseded by a newer one. The code is the text of the line before the
+    cursor, so it is also the cache key together with the cursor position.
+    The cache is cleared on ``invalidate``, called for every execute_input,
+    since any execution may change the names the kernel knows about.
+
+    ``complete`` waits at most ``budget`` seconds for the reply, so that
+    the omnifunc does not freeze nvim while the kernel is busy. A reply
+    arriving later is cached and passed to ``deliver(prefix, result)``,
+    as are the replies of ``complete_async``, which waits ``debounce``
+    seconds for the typing to pause before sending.
+    '''
+    def __init__(self, send, cancel, deliver, log, cache_size=256, debounce=0.05, budget=0.02):
+        self.send = send
+        self.cancel = cancel
+        self.deliver = deliver
+        self.log = log
+        self.cache_size = cache_size
+        self.debounce = debounce
+        self.budget = budget
+        self._cache = OrderedDict()
+        # bumped by invalidate, replies of older requests are not cached
+        self._generation = 0
+        # msgid -> (prefix, generation) of the requests waiting for a reply
+        self._sent = OrderedDict()
+        # the latest request, the others are superseded
+        self._current = None
+        # the request complete() waits for, and the latest reply
+        self._waiting = None
+        self._replied = None
+        self._reply = threading.Event()
+        self._result = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _cached(self, prefix):
+        key = (prefix, len(prefix))
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+        return result
+
+    def _request(self, prefix):
+        # called with the lock held
+        if self._current is not None and self._current in self._sent:
+            self.cancel(self._current)
+        self._reply.clear()
+        self._result = None
+        msgid = self.send(prefix, len(prefix))
+        self._current = msgid
+        self._sent[msgid] = (prefix, self._generation)
+        while len(self._sent) > self.cache_size:
+            self._sent.popitem(last=False)
+        return msgid
+
+    def complete(self, prefix, wait=True):
+        '''Returns the result for ``prefix`` if it is cached or the reply
+        arrives within the budget, None otherwise.'''
+        with self._lock:
+            self._cancel_timer()
+            result = self._cached(prefix)
+            if result is not None:
+                return result
+            msgid = self._request(prefix)
+            if not wait:
+                return None
+            self._waiting = msgid
+        self._reply.wait(self.budget)
+        with self._lock:
+            self._waiting = None
+            if self._replied == msgid:
+                return self._result
+        return None
+
+    def complete_async(self, prefix):
+        with self._lock:
+            self._cancel_timer()
+            result = self._cached(prefix)
+            if result is None:
+                self._timer = threading.Timer(self.debounce, self._debounced, args=(prefix,))
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.deliver(prefix, result)
+
+    def _debounced(self, prefix):
+        with self._lock:
+            self._timer = None
+            self._request(prefix)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def on_reply(self, msgid, content):
+        with self._lock:
+            sent = self._sent.pop(msgid, None)
+            if sent is None:
+                return
+            prefix, generation = sent
+            if content.get('status') != 'ok':
+                result = None
+            else:
+                result = self._result_of(prefix, content)
+                if generation == self._generation:
+                    self._cache[prefix, len(prefix)] = result
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            current = msgid == self._current
+            if current:
+                self._current = None
+                self._replied = msgid
+                self._result = result
+                self._reply.set()
+                # complete() returns it itself
+                current = msgid != self._waiting
+        if current and result is not None:
+            # nvim ignores it unless the text before the cursor is still prefix
+            self.deliver(prefix, result)
+
+    def _result_of(self, prefix, content):
+        # the kernel counts unicode characters, complete() wants a byte column
+        start = content.get('cursor_start', len(prefix))
+        types = content.get('metadata', {}).get('_jupyter_types_experimental')
+        if types and len(types) == len(content['matches']):
+            words = [{'word': item['text'], 'menu': item.get('type', '')}
+                     for item in types]
+        else:
+            words = list(content['matches'])
+        return {'start': len(prefix[:start].encode()), 'words': words}
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
@@ -0,0 +1,151 @@
+import ast
+import json
+import threading
+from collections import OrderedDict
+
+__all__ = (
+    'VariableExplorer',
+)
+
+# run silently in the kernel before each request. Only the summaries and
+# the requested page are turned into text, never a whole object
+_KERNEL_CODE = '''
+class __jupyter_nvim_explorer():
+    import json, reprlib, sys, types
+    _hidden = {'In', 'Out', 'exit', 'quit', 'get_ipython'}
+    _skip = (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)
+
+    @classmethod
+    def _size(cls, obj):
+        nbytes = getattr(obj, 'nbytes', None)
+        if isinstance(nbytes, int):
+            return nbytes
+        try:
+            return int(obj.memory_usage(index=True).sum())
+        except Exception:
+            return cls.sys.getsizeof(obj)
+
+    @classmethod
+    def list(cls):
+        rows = []
+        for name, obj in list(globals().items()):
+            if name.startswith('_') or name in cls._hidden or isinstance(obj, cls._skip):
+                continue
+            shape = getattr(obj, 'shape', None)
+            if not isinstance(shape, tuple):
+                try:
+                    shape = (len(obj),) if not isinstance(obj, (str, bytes)) else None
+                except Exception:
+                    shape = None
+            dtype = getattr(obj, 'dtype', None)
+            if dtype is None and hasattr(obj, 'dtypes'):
+                # the distinct column types of a DataFrame
+                dtype = ','.join(sorted(set(map(str, obj.dtypes))))
+            rows.append([name, type(obj).__name__, list(shape) if shape is not None else None,
+                         str(dtype) if dtype is not None else '', cls._size(obj)])
+        return cls.json.dumps(rows)
+
+    @classmethod
+    def page(cls, name, start, count):
+        obj = globals()[name]
+        end = start + count
+        if hasattr(obj, 'iloc'):
+            text = obj.iloc[start:end].to_string()
+        elif hasattr(obj, 'shape') and hasattr(obj, '__getitem__') and getattr(obj, 'ndim', 0):
+            import numpy
+            text = numpy.array2string(obj[start:end], threshold=count * 100)
+        elif isinstance(obj, dict):
+            import itertools
+            text = '\\n'.join('{!r}: {}'.format(key, cls.reprlib.repr(value))
+                              for key, value in itertools.islice(obj.items(), start, end))
+        elif isinstance(obj, (list, tuple)):
+            text = '\\n'.join(cls.reprlib.repr(item) for item in obj[start:end])
+        else:
+            limited = cls.reprlib.Repr()
+            limited.maxstring = limited.maxother = 100000
+            text = '\\n'.join(limited.repr(obj).split('\\n')[start:end])
+        return cls.json.dumps(text.split('\\n'))
+'''
+
+def _format_size(size):
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            return '{:.0f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.0f}T'.format(size)
+
+class VariableExplorer():
+    '''List the kernel namespace and page through variables.
+
+    ``send(code, user_expressions)`` sends a silent execute_request and
+    returns its msgid, its execute_reply is passed to ``on_reply``. The
+    kernel only sends summaries and pages of ``page_size`` rows, as JSON
+    in a user expression. Results are cached until the execution count
+    changes. ``show(lines, name, page)`` displays them in nvim.
+    '''
+    def __init__(self, send, show, log, page_size=50, cache_size=64):
+        self.send = send
+        self.show = show
+        self.log = log
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.execution_count = None
+        # (name, page) -> lines, name None for the listing
+        self._cache = OrderedDict()
+        # msgid -> (name, page)
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def set_execution_count(self, execution_count):
+        with self._lock:
+            if execution_count != self.execution_count:
+                self.execution_count = execution_count
+                self._cache.clear()
+
+    def request(self, name=None, page=0):
+        key = (name, page)
+        with self._lock:
+            lines = self._cache.get(key)
+            if lines is None:
+                if name is None:
+                    expression = '__jupyter_nvim_explorer.list()'
+                else:
+                    expression = '__jupyter_nvim_explorer.page({!r}, {}, {})'.format(
+                        name, page * self.page_size, self.page_size)
+                msgid = self.send(_KERNEL_CODE, {'result': expression})
+                self._sent[msgid] = key
+                return
+            self._cache.move_to_end(key)
+        self.show(lines, name, page)
+
+    def __contains__(self, msgid):
+        return msgid in self._sent
+
+    def on_reply(self, msgid, content):
+        with self._lock:
+            key = self._sent.pop(msgid, None)
+        if key is None:
+            return
+        name, page = key
+        result = content.get('user_expressions', {}).get('result', {})
+        if content.get('status') != 'ok' or result.get('status') != 'ok':
+            error = result if result.get('status') == 'error' else content
+            lines = ['{}: {}'.format(error.get('ename', 'error'), error.get('evalue', ''))]
+            self.show(lines, name, page)
+            return
+        data = json.loads(ast.literal_eval(result['data']['text/plain']))
+        lines = self._format_list(data) if name is None else data
+        with self._lock:
+            self._cache[key] = lines
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self.show(lines, name, page)
+
+    def _format_list(self, rows):
+        table = [['name', 'type', 'shape', 'dtype', 'size']]
+        for name, type_name, shape, dtype, size in sorted(rows):
+            shape = 'x'.join(map(str, shape)) if shape is not None else ''
+            table.append([name, type_name, shape, dtype, _format_size(size)])
+        widths = [max(len(row[ii]) for row in table) for ii in range(len(table[0]))]
+        return ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                for row in table]
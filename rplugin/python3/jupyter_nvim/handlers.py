@@ -1,7 +1,11 @@
 import tempfile
-import re
+from concurrent.futures import Future
+from functools import partial
+from jupyter_nvim.writer import BufferWriter
+from jupyter_nvim.ansi import strip_ansi, ansi_highlights
 
 __all__ = (
+    'handle',
     'MsgHandler',
     'OutBufMsgHandler'
 )
@@ -9,50 +13,147 @@ __all__ = (
 # learn from notebook/services/kernels/handlers.py
 # learn from notebook/static/services/kernels/kernel.js
 
-_control_seq = re.compile('\x1b\[[0-9;]+m')
-def remove_terminal_control_sequence(string):
-    return re.sub(_control_seq, '', string)
+def _collapse_carriage_return(line):
+    # the text after the last carriage return overwrites the line
+    line = line.rstrip('\r')
+    return line[line.rfind('\r')+1:]
+
+class StreamAssembler():
+    '''Join the text chunks of one output stream into lines.
+
+    The trailing partial line is kept until its newline arrives, and
+    carriage returns are collapsed so that only the latest rewrite of a
+    line is sent to nvim.
+    '''
+    def __init__(self):
+        # the open line, ending with '\r' if the next text overwrites it
+        self.line = None
+
+    def reset(self):
+        self.line = None
+
+    def feed(self, text):
+        # returns (lines, partial). If a line was open, lines[0] is its new
+        # content. partial tells whether lines[-1] is still open.
+        if self.line is not None:
+            text = self.line + text
+        lines = text.split('\n')
+        tail = lines.pop()
+        lines = [_collapse_carriage_return(line) for line in lines]
+        if tail:
+            line = _collapse_carriage_return(tail)
+            self.line = line + '\r' if tail.endswith('\r') else line
+            lines.append(line)
+            return lines, True
+        self.line = None
+        return lines, False
 
 def handle(channel, msg_type):
     def wrapper(f):
-        def wrapped(self, *args, **kwargs):
-            return f(self, *args, **kwargs)
-        return wrapped
+        f._msg_handle = (channel, msg_type)
+        return f
     return wrapper
 
 class MsgHandler():
+    # (channel, msg_type) -> method name, collected from the @handle
+    # decorators when the class is created
+    _dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        dispatch = dict(cls._dispatch)
+        for name, attr in vars(cls).items():
+            key = getattr(attr, '_msg_handle', None)
+            if key is not None:
+                dispatch[key] = name
+        cls._dispatch = dispatch
+
     def __init__(self, nvim, log):
         self.nvim = nvim
         self.bufs = []
         self.log = log
+        self.handlers = {key: getattr(self, name) for key, name in self._dispatch.items()}
+        # (channel, msg_type) without a handler, logged once
+        self._unhandled = set()
 
     def __bool__(self):
         return bool(self.bufs)
 
     def __call__(self, channel, msg, **kwargs):
         msg_type = msg['header']['msg_type']
-        func_name = channel + '_' + msg_type
-
-        content = msg['content']
-        if hasattr(self, func_name):
-            getattr(self, func_name)(content, msg=msg, **kwargs)
-            return True
-        else:
+        func = self.handlers.get((channel, msg_type))
+        if func is None:
+            if (channel, msg_type) not in self._unhandled:
+                self._unhandled.add((channel, msg_type))
+                self.log.debug('no handler for %s %s', channel, msg_type)
             return False
+        func(msg['content'], msg=msg, **kwargs)
+        return True
 
     def get_data(self, content):
-        # TODO: handle different mime types
+        # text/plain only: the other mime types of execute_result and
+        # display_data go through append_data and the renderer, inspect
+        # replies are plain text with ansi colors
         data = content['data']
         output = data.get('text/plain')
         if output is not None:
             return output
 
 class OutBufMsgHandler(MsgHandler):
-    def append(self, lines):
+    def __init__(self, nvim, log, flush_interval=0.05, flush_lines=1000, spill=None, renderer=None,
+                 ansi_highlight=False, quickfix=None, async_call=None, throttle=None):
+        super(OutBufMsgHandler, self).__init__(nvim, log)
+        self.quickfix = quickfix
+        self.throttle = throttle
+        self.renderer = renderer
+        self.ansi_highlight = ansi_highlight
+        self.writer = BufferWriter(nvim, log, self.bufs,
+                                   flush_interval=flush_interval, flush_lines=flush_lines,
+                                   spill=spill, async_call=async_call)
+        # stream name -> StreamAssembler
+        self.streams = {}
+
+    def add_buffer(self, buf, max_lines=None):
+        self.writer.add_buffer(buf, max_lines=max_lines)
+
+    def remove_buffer(self, bufno):
+        self.writer.remove_buffer(bufno)
+
+    def append(self, lines, cell=False):
         if isinstance(lines, str):
             lines = lines.split('\n')
-        for buf in self.bufs:
-            self.nvim.async_call(buf.append, lines)
+        self.writer.write(lines, cell=cell)
+
+    def append_ansi(self, lines, owner=None, partial=False):
+        # strips the escape sequences, or turns their colors into highlights.
+        # An open partial line is only stripped, it is highlighted once complete
+        if isinstance(lines, str):
+            lines = lines.split('\n')
+        highlights = None
+        if self.ansi_highlight:
+            complete = lines[:-1] if partial else lines
+            complete, highlights = ansi_highlights(complete)
+            if partial:
+                complete.append(strip_ansi(lines[-1]))
+            lines = complete
+        else:
+            lines = [strip_ansi(line) for line in lines]
+        self.writer.write(lines, owner=owner, partial=partial, highlights=highlights)
+
+    def flush(self):
+        self.writer.flush()
+
+    def release_throttle(self):
+        # writes the marker and the tail of the stream output suppressed by
+        # the throttle, before any other output
+        if self.throttle is None:
+            return
+        released = self.throttle.release()
+        if released is not None:
+            marker, tail = released
+            self.append(marker)
+            for name, text in tail:
+                self.write_stream(name, text)
 
     def on_finish_kernel_info(self, kernel_info, pending_shell_msgs, pending_iopub_msgs):
         self.append(kernel_info['banner'])
@@ -84,36 +185,76 @@ class OutBufMsgHandler(MsgHandler):
         return lines
 
     ### SHELL messages
+    @handle('shell', 'inspect_reply')
     def shell_inspect_reply(self, content, **kwargs):
         if content['status'] == 'ok' and content['found']:
             data = self.get_data(content)
-            data = remove_terminal_control_sequence(data)
-            self.append(data)
+            self.append_ansi(data)
 
     ### IOPUB messages
+    @handle('iopub', 'execute_input')
     def iopub_execute_input(self, content, **kwargs):
+        self.release_throttle()
         code = self.format_input(content['execution_count'], content['code'])
-        self.append(code)
+        self.append(code, cell=True)
 
-    def iopub_execute_result(self, content, **kwargs):
-        output = self.get_data(content)
-        if output:
-            output = self.format_output(content['execution_count'], output)
+    def append_data(self, data, format):
+        if self.renderer is None:
+            output = data.get('text/plain')
+            output = format(output) if output is not None else None
+        else:
+            output = self.renderer.render(data, format)
+        if isinstance(output, Future):
+            self.writer.write_future(output)
+        elif output is not None:
             self.append(output)
 
+    def format_display(self, string):
+        lines = string.split('\n')
+        lines.append('')
+        return lines
+
+    @handle('iopub', 'execute_result')
+    def iopub_execute_result(self, content, **kwargs):
+        self.release_throttle()
+        self.append_data(content['data'], partial(self.format_output, content['execution_count']))
+
+    @handle('iopub', 'display_data')
+    def iopub_display_data(self, content, **kwargs):
+        self.release_throttle()
+        self.append_data(content['data'], self.format_display)
+
+    @handle('iopub', 'error')
     def iopub_error(self, content, **kwargs):
+        self.release_throttle()
         message = '{}: {}'.format(content['ename'], content['evalue'])
-        self.append(message.split('\n'))
-        traceback = [remove_terminal_control_sequence(line) for line in content['traceback']]
-        def set_traceback(nvim, traceback):
-            self.log.error('%s %s', type(nvim.api.vars), type(nvim))
-            nvim.vars['jupyter_nvim_traceback'] = traceback
-            nvim.command('cgetexpr jupyter_nvim_traceback')
-        self.nvim.async_call(set_traceback, self.nvim, traceback)
-
-    def iopub_stream(self, content, msg, **kwargs):
-        content = msg['content']
-        stream = content['text'].split('\n')
-        if stream and stream[-1] == '':
-            stream.pop(-1)
-        self.append(stream)
+        self.append_ansi(message)
+        self.flush()
+        if self.quickfix is not None:
+            self.quickfix.set_traceback(content['traceback'])
+
+    @handle('iopub', 'status')
+    def iopub_status(self, content, **kwargs):
+        if content['execution_state'] == 'idle':
+            self.release_throttle()
+            self.flush()
+
+    @handle('iopub', 'stream')
+    def iopub_stream(self, content, **kwargs):
+        name = content['name']
+        text = content['text']
+        if self.throttle is not None:
+            if not self.throttle.admit(name, text):
+                return
+            self.release_throttle()
+        self.write_stream(name, text)
+
+    def write_stream(self, name, text):
+        assembler = self.streams.get(name)
+        if assembler is None:
+            assembler = self.streams[name] = StreamAssembler()
+        elif self.writer.open != name:
+            # other output has closed the open line of this stream
+            assembler.reset()
+        lines, partial = assembler.feed(text)
+        self.append_ansi(lines, owner=name, partial=partial)
@@ -0,0 +1,241 @@
+import collections
+import threading
+import time
+import zmq
+
+__all__ = (
+    'HealthMonitor',
+)
+
+ALIVE = 'alive'
+UNRESPONSIVE = 'unresponsive'
+DEAD = 'dead'
+RESTARTING = 'restarting'
+
+def _hb_url(client):
+    if client.transport == 'tcp':
+        return 'tcp://{}:{}'.format(client.ip, client.hb_port)
+    return '{}://{}-{}'.format(client.transport, client.ip, client.hb_port)
+
+class _Health():
+    # heartbeat state of one child app, only used by the monitor thread
+    # except for execution_state and the read-only stats. history is
+    # appended and copied under the lock of the monitor
+    def __init__(self, url, history):
+        self.url = url
+        self.socket = None
+        self.sent = None
+        self.next_ping = 0.0
+        self.srtt = None
+        self.rttvar = None
+        self.misses = 0
+        self.restarts = 0
+        self.grace_until = 0.0
+        self.state = ALIVE
+        self.execution_state = None
+        self.missed_beats = 0
+        # (time.time(), rtt in seconds, None for a missed ping)
+        self.history = collections.deque(maxlen=history)
+
+    def add_rtt(self, rtt):
+        # the smoothed round trip time and its deviation, as TCP does
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.history.append((time.time(), rtt))
+
+class HealthMonitor():
+    '''Heartbeat monitor of the kernels of the child apps.
+
+    One thread pings the heartbeat channel of every kernel each
+    ``interval`` seconds with its own REQ socket. The timeout of a ping
+    adapts to the round trip times: smoothed RTT plus four times its
+    deviation, within ``min_timeout`` and ``max_timeout``, and multiplied by
+    ``busy_factor`` while the kernel is busy according to its iopub status.
+    After ``max_misses`` missed pings in a row, the kernel is dead and
+    ``on_dead(childid)`` is called once, in a thread of its own since it
+    may restart the kernel. Misses are then ignored for ``restart_grace``
+    seconds, until the kernel has started again. ``on_alive(childid)`` is
+    called, in the monitor thread, when a dead or restarting kernel answers
+    again.
+    '''
+    def __init__(self, log, on_dead, on_alive=None, interval=1.0, min_timeout=0.5, max_timeout=10.0,
+                 max_misses=3, busy_factor=4.0, restart_grace=30.0, history=300):
+        self.log = log
+        self.on_dead = on_dead
+        self.on_alive = on_alive
+        self.interval = interval
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_misses = max_misses
+        self.busy_factor = busy_factor
+        self.restart_grace = restart_grace
+        self.history = history
+        # childid -> _Health
+        self._apps = {}
+        # sockets of removed apps, closed by the monitor thread
+        self._closing = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._context = zmq.Context.instance()
+        self._thread = None
+
+    def add(self, childid, kernel_client):
+        with self._lock:
+            self._apps[childid] = _Health(_hb_url(kernel_client), self.history)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='jupyter-nvim-health', daemon=True)
+                self._thread.start()
+
+    def remove(self, childid):
+        with self._lock:
+            health = self._apps.pop(childid, None)
+            if health is not None and health.socket is not None:
+                self._closing.append(health.socket)
+
+    def set_execution_state(self, childid, state):
+        health = self._apps.get(childid)
+        if health is not None:
+            health.execution_state = state
+
+    def on_missed_beat(self, childid, since_last):
+        # the heartbeat channel of the kernel client missed a beat too. It is
+        # only recorded, the monitor decides with its own pings
+        health = self._apps.get(childid)
+        if health is not None:
+            health.missed_beats += 1
+            self.log.info('heart beat of child app %s missed, last beat %.1f s ago', childid, since_last)
+
+    def timeout(self, health):
+        if health.srtt is None:
+            timeout = self.max_timeout
+        else:
+            timeout = min(max(health.srtt + 4 * health.rttvar, self.min_timeout), self.max_timeout)
+        if health.execution_state == 'busy':
+            timeout *= self.busy_factor
+        return timeout
+
+    def _connect(self, health):
+        socket = self._context.socket(zmq.REQ)
+        socket.linger = 0
+        socket.connect(health.url)
+        health.socket = socket
+
+    def _run(self):
+        poller_timeout = int(self.interval * 1000)
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            with self._lock:
+                for socket in self._closing:
+                    socket.close()
+                self._closing = []
+                apps = list(self._apps.items())
+            poller = zmq.Poller()
+            sockets = {}
+            wake = now + self.interval
+            for childid, health in apps:
+                if health.socket is None:
+                    self._connect(health)
+                if health.sent is None and now >= health.next_ping:
+                    health.socket.send(b'ping')
+                    health.sent = now
+                if health.sent is not None:
+                    poller.register(health.socket, zmq.POLLIN)
+                    sockets[health.socket] = childid, health
+                    wake = min(wake, health.sent + self.timeout(health))
+                else:
+                    wake = min(wake, health.next_ping)
+            timeout = max(int((wake - time.monotonic()) * 1000), 0)
+            if sockets:
+                events = dict(poller.poll(min(timeout, poller_timeout)))
+            else:
+                events = {}
+                self._stopped.wait(min(timeout, poller_timeout) / 1000)
+            now = time.monotonic()
+            for socket, (childid, health) in sockets.items():
+                if socket in events:
+                    socket.recv()
+                    self._pong(childid, health, now)
+                elif now - health.sent > self.timeout(health):
+                    self._missed(childid, health, now)
+        with self._lock:
+            for socket in self._closing:
+                socket.close()
+            for health in self._apps.values():
+                if health.socket is not None:
+                    health.socket.close()
+
+    def _pong(self, childid, health, now):
+        with self._lock:
+            health.add_rtt(now - health.sent)
+        health.sent = None
+        health.next_ping = now + self.interval
+        health.misses = 0
+        if health.state != ALIVE:
+            self.log.info('kernel of child app %s is %s again', childid, ALIVE)
+            previous, health.state = health.state, ALIVE
+            if previous in (DEAD, RESTARTING) and self.on_alive is not None:
+                try:
+                    self.on_alive(childid)
+                except Exception:
+                    self.log.exception('on_alive failed for child app %s', childid)
+
+    def _missed(self, childid, health, now):
+        with self._lock:
+            health.history.append((time.time(), None))
+        # a REQ socket cannot send again before it receives the reply
+        health.socket.close()
+        health.socket = None
+        health.sent = None
+        health.next_ping = now
+        if now < health.grace_until or health.state == DEAD:
+            return
+        health.misses += 1
+        if health.misses < self.max_misses:
+            health.state = UNRESPONSIVE
+            self.log.warning('kernel of child app %s missed %d heart beats', childid, health.misses)
+            return
+        health.state = DEAD
+        self.log.error('kernel of child app %s is dead', childid)
+        threading.Thread(target=self._dead, args=(childid, health), daemon=True).start()
+
+    def _dead(self, childid, health):
+        try:
+            restarted = self.on_dead(childid)
+        except Exception:
+            self.log.exception('failed to restart the kernel of child app %s', childid)
+            restarted = False
+        if restarted:
+            health.grace_until = time.monotonic() + self.restart_grace
+            health.restarts += 1
+            health.state = RESTARTING
+            health.srtt = health.rttvar = None
+            health.misses = 0
+            health.execution_state = 'starting'
+
+    def stats(self, childid):
+        health = self._apps.get(childid)
+        if health is None:
+            return None
+        with self._lock:
+            history = list(health.history)
+        return {
+            'state': health.state,
+            'execution_state': health.execution_state,
+            'srtt_ms': health.srtt * 1000 if health.srtt is not None else None,
+            'rttvar_ms': health.rttvar * 1000 if health.rttvar is not None else None,
+            'timeout_ms': self.timeout(health) * 1000,
+            'misses': health.misses,
+            'missed_beats': health.missed_beats,
+            'restarts': health.restarts,
+            'history': [[stamp, rtt * 1000 if rtt is not None else None]
+                        for stamp, rtt in history],
+        }
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
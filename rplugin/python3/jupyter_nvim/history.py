@@ -0,0 +1,205 @@
+import datetime
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+__all__ = (
+    'HistoryStore',
+)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS inputs (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    execution_count INTEGER NOT NULL,
+    -- NULL for the inputs backfilled from the kernel, run at an unknown time
+    time REAL,
+    source TEXT NOT NULL,
+    UNIQUE (session, execution_count)
+);
+CREATE INDEX IF NOT EXISTS inputs_time ON inputs (time);
+CREATE INDEX IF NOT EXISTS inputs_execution_count ON inputs (execution_count);
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    execution_count INTEGER NOT NULL,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_execution ON outputs (session, execution_count);
+'''
+
+# full-text index of the sources, kept up to date by triggers. Only used
+# if the sqlite library has fts5
+_FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS inputs_fts USING fts5(source, content='inputs', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS inputs_fts_insert AFTER INSERT ON inputs BEGIN
+    INSERT INTO inputs_fts (rowid, source) VALUES (new.id, new.source);
+END;
+CREATE TRIGGER IF NOT EXISTS inputs_fts_delete AFTER DELETE ON inputs BEGIN
+    INSERT INTO inputs_fts (inputs_fts, rowid, source) VALUES ('delete', old.id, old.source);
+END;
+'''
+
+_INSERT_INPUT = 'INSERT OR IGNORE INTO inputs (session, execution_count, time, source) VALUES (?, ?, ?, ?)'
+_INSERT_OUTPUT = 'INSERT INTO outputs (session, execution_count, time, kind, text) VALUES (?, ?, ?, ?, ?)'
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    # several child apps, and nvim sessions, write to the same file
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class HistoryStore():
+    '''Executed code and its results, in an SQLite database.
+
+    Inputs are keyed by the session id of the kernel and the execution
+    count, and indexed by time and by their source, with fts5 if sqlite has
+    it. Inputs backfilled from the kernel have no time, they are listed
+    after the others, by session and execution count.
+
+    ``add_input`` and ``add_output`` only queue the rows: a writer
+    thread inserts them in batches of up to ``batch_size`` rows, one
+    transaction per batch, waiting at most ``flush_interval`` seconds for
+    a batch to fill. Reads go through another connection, so that they do
+    not wait for the writer.
+    '''
+    def __init__(self, path, log, batch_size=500, flush_interval=0.5):
+        self.path = path
+        self.log = log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = _connect(path)
+        with conn:
+            conn.executescript(_SCHEMA)
+            try:
+                conn.executescript(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+        self._writer_conn = conn
+        self._reader_conn = None
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name='jupyter-nvim-history', daemon=True)
+        self._thread.start()
+
+    def add_input(self, session, execution_count, source, backfill=False):
+        timestamp = None if backfill else time.time()
+        self._queue.put((_INSERT_INPUT, (session, execution_count, timestamp, source)))
+
+    def add_output(self, session, execution_count, kind, text):
+        self._queue.put((_INSERT_OUTPUT, (session, execution_count, time.time(), kind, text)))
+
+    def _write_loop(self):
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None \
+                    and not isinstance(batch[-1], threading.Event):
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            events = [item for item in batch if isinstance(item, threading.Event)]
+            closing = batch[-1] is None
+            rows = [item for item in batch if isinstance(item, tuple)]
+            try:
+                with self._writer_conn:
+                    for sql, params in rows:
+                        self._writer_conn.execute(sql, params)
+            except sqlite3.Error:
+                self.log.exception('failed to write %d history rows', len(rows))
+            for event in events:
+                event.set()
+        self._writer_conn.close()
+
+    def flush(self, timeout=5):
+        '''Waits until the rows queued so far are written.'''
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(5)
+        with self._read_lock:
+            if self._reader_conn is not None:
+                self._reader_conn.close()
+                self._reader_conn = None
+
+    def _read(self, sql, params):
+        with self._read_lock:
+            if self._reader_conn is None:
+                self._reader_conn = _connect(self.path)
+            return self._reader_conn.execute(sql, params).fetchall()
+
+    def _match(self, query):
+        # sql condition and params selecting the inputs matching all words
+        words = query.split()
+        if self.fts:
+            # each word quoted, so that the fts5 query syntax does not apply
+            phrase = ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+            return 'id IN (SELECT rowid FROM inputs_fts WHERE inputs_fts MATCH ?)', [phrase]
+        escaped = [word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for word in words]
+        return ' AND '.join(["source LIKE ? ESCAPE '\\'"] * len(words)), ['%' + word + '%' for word in escaped]
+
+    def search(self, query=None, session=None, execution_count=None, limit=50, offset=0):
+        '''Returns the inputs matching the filters, newest first, as
+        (session, execution_count, time, source, [(kind, text)]) tuples.'''
+        conditions, params = [], []
+        if query and query.split():
+            condition, match_params = self._match(query)
+            conditions.append(condition)
+            params.extend(match_params)
+        if session is not None:
+            conditions.append('session = ?')
+            params.append(session)
+        if execution_count is not None:
+            conditions.append('execution_count = ?')
+            params.append(execution_count)
+        sql = 'SELECT session, execution_count, time, source FROM inputs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # NULL times sort last
+        sql += ' ORDER BY time DESC, session, execution_count DESC LIMIT ? OFFSET ?'
+        inputs = self._read(sql, params + [limit, offset])
+        if not inputs:
+            return []
+        # the outputs of the page only
+        outputs = {}
+        keys = ' OR '.join(['(session = ? AND execution_count = ?)'] * len(inputs))
+        rows = self._read('SELECT session, execution_count, kind, text FROM outputs WHERE ' + keys + ' ORDER BY id',
+                          [value for row in inputs for value in row[:2]])
+        for row_session, row_count, kind, text in rows:
+            outputs.setdefault((row_session, row_count), []).append((kind, text))
+        return [(row_session, row_count, stamp, source, outputs.get((row_session, row_count), []))
+                for row_session, row_count, stamp, source in inputs]
+
+    def format(self, entries, max_output_lines=10):
+        lines = []
+        for session, execution_count, stamp, source, outputs in entries:
+            if stamp is None:
+                date = 'before nvim'
+            else:
+                date = datetime.datetime.fromtimestamp(stamp).strftime('%Y-%m-%d %H:%M:%S')
+            lines.append('# In [{}] {} {}'.format(execution_count, date, session[:8]))
+            lines.extend(source.split('\n'))
+            for kind, text in outputs:
+                text_lines = text.split('\n')
+                if len(text_lines) > max_output_lines:
+                    text_lines = text_lines[:max_output_lines] + ['[{} more lines]'.format(
+                        len(text_lines) - max_output_lines)]
+                lines.append('# {} [{}]:'.format('Out' if kind == 'result' else kind.capitalize(),
+                                                  execution_count))
+                lines.extend('# ' + line for line in text_lines)
+            lines.append('')
+        return lines
@@ -25,7 +25,6 @@ class JupyterNvimPlugin(object):
         bufapp = self.app.start_child_app(bufno, [])
         bufapp.register_out_vim_buffer(self, bufno)
         self.log.info('child app %d started', bufno)
-        # self.zerorpc.print(message)
 
     @neovim.command('JupyterExecute', nargs="*", range=False)
     def execute(self, args):
@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+__all__ = (
+    'MimeRenderer',
+    'html_to_text',
+)
+
+# text/plain of objects that only have a rich representation,
+# e.g. <IPython.core.display.HTML object>
+_object_repr = re.compile(r'^<[\w.]+ object>$')
+
+class _HTMLText(HTMLParser):
+    _blocks = {'p', 'div', 'br', 'tr', 'li', 'pre', 'table', 'thead', 'tbody',
+               'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'hr'}
+    _skip = {'script', 'style', 'head'}
+
+    def __init__(self):
+        super(_HTMLText, self).__init__(convert_charrefs=True)
+        self.lines = []
+        self.line = []
+        self.skip = 0
+        # rows of the table being parsed, each row a list of cells
+        self.rows = None
+        self.cell = None
+
+    def newline(self):
+        if self.line:
+            self.lines.append(''.join(self.line).rstrip())
+            self.line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._skip:
+            self.skip += 1
+        elif tag == 'table':
+            self.newline()
+            self.rows = []
+        elif self.rows is not None and tag == 'tr':
+            self.rows.append([])
+        elif self.rows is not None and tag in ('td', 'th'):
+            self.cell = []
+        elif tag in self._blocks:
+            self.newline()
+
+    def handle_endtag(self, tag):
+        if tag in self._skip:
+            self.skip = max(self.skip - 1, 0)
+        elif tag == 'table' and self.rows is not None:
+            self.lines.extend(self.format_table(self.rows))
+            self.rows = None
+        elif self.cell is not None and tag in ('td', 'th'):
+            if not self.rows:
+                self.rows.append([])
+            self.rows[-1].append(' '.join(''.join(self.cell).split()))
+            self.cell = None
+        elif tag in self._blocks:
+            self.newline()
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if self.cell is not None:
+            self.cell.append(data)
+        elif self.rows is None:
+            self.line.append(data if self.line else data.lstrip())
+
+    def format_table(self, rows):
+        rows = [row for row in rows if row]
+        if not rows:
+            return []
+        ncol = max(len(row) for row in rows)
+        widths = [max(len(row[ii]) if ii < len(row) else 0 for row in rows) for ii in range(ncol)]
+        return ['  '.join(cell.rjust(width) for cell, width in zip(row, widths)).rstrip()
+                for row in rows]
+
+    def text(self):
+        self.close()
+        self.newline()
+        return '\n'.join(self.lines)
+
+def html_to_text(html):
+    parser = _HTMLText()
+    parser.feed(html)
+    return parser.text()
+
+class MimeRenderer():
+    '''Render the mime bundle of execute_result and display_data to text.
+
+    ``converters`` maps a mimetype to a function converting the data of
+    that type to text, ``priority`` lists the mimetypes in order of
+    preference. text/plain is returned as is, other types are converted in
+    a thread pool and the results are cached by content hash.
+    '''
+    def __init__(self, log, priority=None, max_workers=2, cache_size=128):
+        self.log = log
+        self.priority = priority or ['image/png', 'text/markdown', 'text/plain', 'text/html']
+        self.converters = {
+            'text/plain': None,
+            'text/markdown': None,
+            'text/html': html_to_text,
+            'image/png': self.save_png,
+        }
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._image_dir = None
+
+    def register(self, mimetype, converter, priority=None):
+        self.converters[mimetype] = converter
+        if mimetype not in self.priority:
+            self.priority.insert(len(self.priority) if priority is None else priority, mimetype)
+
+    def choose(self, data):
+        for mimetype in self.priority:
+            if mimetype not in data or mimetype not in self.converters:
+                continue
+            if mimetype == 'text/plain' and _object_repr.match(data[mimetype]) \
+                    and any(other in data for other in self.priority if other != mimetype):
+                continue
+            return mimetype
+
+    def render(self, data, format):
+        '''Return ``format(text)`` of the preferred representation in
+        ``data``, or a Future of it if the conversion runs in the pool.
+        None if no mimetype can be rendered.'''
+        mimetype = self.choose(data)
+        if mimetype is None:
+            return None
+        content = data[mimetype]
+        converter = self.converters[mimetype]
+        if converter is None:
+            return format(content)
+        key = (mimetype, hashlib.sha1(content.encode()).hexdigest())
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return format(text)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor.submit(self._convert, key, converter, content, format)
+
+    def _convert(self, key, converter, content, format):
+        text = converter(content)
+        with self._lock:
+            self._cache[key] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return format(text)
+
+    def save_png(self, content):
+        raw = base64.b64decode(content)
+        with self._lock:
+            if self._image_dir is None:
+                self._image_dir = tempfile.mkdtemp(prefix='jupyter-nvim-images-')
+        path = os.path.join(self._image_dir, hashlib.sha1(raw).hexdigest() + '.png')
+        with open(path, 'wb') as f:
+            f.write(raw)
+        return '[image/png {} bytes: {}]'.format(len(raw), path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
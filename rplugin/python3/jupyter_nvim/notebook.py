@@ -0,0 +1,268 @@
+import difflib
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+
+__all__ = (
+    'Notebook',
+    'NotebookCell',
+    'parse_buffer',
+)
+
+_marker = re.compile(r'^# %%(?: \[(?P<type>markdown|raw)\])?\s*$')
+
+def _split_source(source):
+    # nbformat stores multiline strings as lists of lines
+    return source.splitlines(keepends=True)
+
+def _join_source(source):
+    return ''.join(source) if isinstance(source, list) else source
+
+def _marker_line(cell_type):
+    return '# %%' if cell_type == 'code' else '# %% [{}]'.format(cell_type)
+
+def parse_buffer(lines):
+    '''Split the lines of a notebook buffer into (cell_type, source) at the
+    ``# %%`` markers written by ``Notebook.render``.'''
+    cells = []
+    cell_type = None
+    cell = []
+    for line in lines:
+        match = _marker.match(line)
+        if match:
+            if cell_type is not None or any(line.strip() for line in cell):
+                cells.append((cell_type or 'code', '\n'.join(cell)))
+            cell_type = match.group('type') or 'code'
+            cell = []
+        else:
+            cell.append(line)
+    if cell_type is not None or any(line.strip() for line in cell):
+        cells.append((cell_type or 'code', '\n'.join(cell)))
+    return cells
+
+class NotebookCell():
+    '''One cell of a notebook.
+
+    An unchanged cell only keeps ``fragment``, its JSON text as read from
+    the file, and is written back verbatim. The cell is parsed from the
+    fragment when it is changed, and serialized again by the next save.
+    Outputs, with their base64 images, are therefore only decoded from JSON
+    for cells that are executed or edited.
+    '''
+    __slots__ = ('notebook', 'cell_type', 'source', 'fragment', '_cell')
+
+    def __init__(self, notebook, cell_type, source, fragment=None, cell=None):
+        self.notebook = notebook
+        self.cell_type = cell_type
+        self.source = source
+        self.fragment = fragment
+        self._cell = cell
+
+    def __str__(self):
+        return 'cell {} of {}'.format(self.notebook.index(self) + 1, self.notebook.path)
+
+    @property
+    def dirty(self):
+        return self.fragment is None
+
+    def data(self):
+        # the cell as a dict, marked as changed
+        if self._cell is None:
+            self._cell = json.loads(self.fragment)
+        self.fragment = None
+        return self._cell
+
+    def set_source(self, source):
+        self.data()['source'] = _split_source(source)
+        self.source = source
+
+    def serialize(self):
+        if self.fragment is None:
+            text = json.dumps(self._cell, indent=1, sort_keys=True, ensure_ascii=False)
+            # at the indentation of the items of the cells list
+            self.fragment = text.replace('\n', '\n  ')
+            self._cell = None
+        return self.fragment
+
+    # clear_outputs and add_output are called by the thread of the kernel
+    # messages, they hold the lock of the notebook against save
+
+    def clear_outputs(self, execution_count=None):
+        with self.notebook._lock:
+            cell = self.data()
+            cell['outputs'] = []
+            cell['execution_count'] = execution_count
+
+    def add_output(self, msg_type, content):
+        with self.notebook._lock:
+            self._add_output(msg_type, content)
+
+    def _add_output(self, msg_type, content):
+        cell = self.data()
+        outputs = cell.setdefault('outputs', [])
+        if msg_type == 'stream':
+            if outputs and outputs[-1]['output_type'] == 'stream' and outputs[-1]['name'] == content['name']:
+                text = _join_source(outputs[-1]['text']) + content['text']
+                outputs[-1]['text'] = _split_source(text)
+            else:
+                outputs.append({'output_type': 'stream', 'name': content['name'],
+                                'text': _split_source(content['text'])})
+        elif msg_type == 'execute_result':
+            outputs.append({'output_type': 'execute_result', 'data': content['data'],
+                            'metadata': content.get('metadata', {}),
+                            'execution_count': content['execution_count']})
+        elif msg_type == 'display_data':
+            outputs.append({'output_type': 'display_data', 'data': content['data'],
+                            'metadata': content.get('metadata', {})})
+        elif msg_type == 'error':
+            outputs.append({'output_type': 'error', 'ename': content['ename'],
+                            'evalue': content['evalue'], 'traceback': content['traceback']})
+        elif msg_type == 'clear_output':
+            cell['outputs'] = []
+
+def _new_cell(notebook, cell_type, source):
+    cell = {'cell_type': cell_type, 'metadata': {}, 'source': _split_source(source)}
+    if (notebook.nbformat, notebook.nbformat_minor) >= (4, 5):
+        # required since nbformat 4.5, as generated by nbformat
+        cell['id'] = uuid.uuid4().hex[:8]
+    if cell_type == 'code':
+        cell['execution_count'] = None
+        cell['outputs'] = []
+    return NotebookCell(notebook, cell_type, source, cell=cell)
+
+class Notebook():
+    '''A .ipynb file mapped onto a buffer of ``# %%`` cells.
+
+    ``sync(lines)`` applies the buffer to the cells: the sources are
+    matched with difflib, so that the cells keep their outputs and
+    metadata, and only the edited, inserted and executed cells are
+    serialized again by ``save``. The file is replaced atomically.
+    '''
+    def __init__(self, path, cells, metadata, nbformat=4, nbformat_minor=2):
+        self.path = path
+        self.cells = cells
+        self.metadata = metadata
+        self.nbformat = nbformat
+        self.nbformat_minor = nbformat_minor
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            notebook = cls(path, [], {})
+            notebook.cells.append(_new_cell(notebook, 'code', ''))
+            return notebook
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        # walk the top level object with raw_decode, so that the JSON text
+        # of each cell is known and can be written back as is
+        decoder = json.JSONDecoder()
+        ws = re.compile(r'\s*')
+        notebook = cls(path, [], {})
+        top = {}
+        idx = ws.match(text, 0).end()
+        if text[idx:idx+1] != '{':
+            raise ValueError('{} is not a notebook'.format(path))
+        idx = ws.match(text, idx + 1).end()
+        while text[idx:idx+1] != '}':
+            key, idx = json.decoder.scanstring(text, idx + 1)
+            idx = ws.match(text, idx).end() + 1  # the colon
+            idx = ws.match(text, idx).end()
+            if key == 'cells':
+                idx = notebook._load_cells(decoder, text, idx)
+            else:
+                top[key], idx = decoder.raw_decode(text, idx)
+            idx = ws.match(text, idx).end()
+            if text[idx:idx+1] == ',':
+                idx = ws.match(text, idx + 1).end()
+        notebook.metadata = top.get('metadata', {})
+        notebook.nbformat = top.get('nbformat', 4)
+        notebook.nbformat_minor = top.get('nbformat_minor', 2)
+        return notebook
+
+    def _load_cells(self, decoder, text, idx):
+        ws = re.compile(r'\s*')
+        idx = ws.match(text, idx + 1).end()  # the bracket
+        while text[idx:idx+1] != ']':
+            cell, end = decoder.raw_decode(text, idx)
+            self.cells.append(NotebookCell(self, cell['cell_type'], _join_source(cell['source']),
+                                           fragment=text[idx:end]))
+            idx = ws.match(text, end).end()
+            if text[idx:idx+1] == ',':
+                idx = ws.match(text, idx + 1).end()
+        return idx + 1
+
+    def index(self, cell):
+        for ii, other in enumerate(self.cells):
+            if other is cell:
+                return ii
+        return -1
+
+    def render(self):
+        lines = []
+        for cell in self.cells:
+            lines.append(_marker_line(cell.cell_type))
+            lines.extend(cell.source.split('\n'))
+        return lines
+
+    def sync(self, lines):
+        new = parse_buffer(lines)
+        with self._lock:
+            old = [(cell.cell_type, cell.source) for cell in self.cells]
+            cells = []
+            matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    cells.extend(self.cells[i1:i2])
+                    continue
+                # edited cells keep their outputs and metadata
+                for ii, (cell_type, source) in zip(range(i1, i2), new[j1:j2]):
+                    cell = self.cells[ii]
+                    if cell.cell_type != cell_type:
+                        cell = _new_cell(self, cell_type, source)
+                    else:
+                        cell.set_source(source)
+                    cells.append(cell)
+                for cell_type, source in new[j1 + (i2 - i1):j2]:
+                    cells.append(_new_cell(self, cell_type, source))
+            self.cells = cells
+
+    def cell_at(self, row):
+        # the cell shown at the 0-based row of the rendered buffer
+        for cell in self.cells:
+            row -= 1 + len(cell.source.split('\n'))
+            if row < 0:
+                return cell
+        return None
+
+    @property
+    def dirty(self):
+        return any(cell.dirty for cell in self.cells)
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            fragments = [cell.serialize() for cell in self.cells]
+            top = json.dumps({'metadata': self.metadata, 'nbformat': self.nbformat,
+                              'nbformat_minor': self.nbformat_minor},
+                             indent=1, sort_keys=True, ensure_ascii=False)
+        # the layout of nbformat: indent=1 and sorted keys, cells first
+        cells = ',\n  '.join(fragments)
+        text = '{\n "cells": [' + ('\n  ' + cells + '\n ' if cells else '') + '],\n' + top[2:] + '\n'
+        fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path), suffix='.tmp',
+                                   dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(tmp, os.stat(path).st_mode & 0o777)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -1,4 +1,5 @@
 import neovim
+import msgpack
 from neovim.api.buffer import Buffer, Range
 from neovim.api import NvimError
 from jupyter_container.application import (
@@ -6,13 +7,31 @@ from jupyter_container.application import (
     catch_exception
 )
 from jupyter_nvim.handlers import *
+from jupyter_nvim.writer import SpillFile
+from jupyter_nvim.cells import split_cells
+from jupyter_nvim.scheduler import ExecutionScheduler, QueueFull
+from jupyter_nvim.tracker import RequestTracker
+from jupyter_nvim.mime import MimeRenderer
+from jupyter_nvim.quickfix import QuickfixList
+from jupyter_nvim.pool import KernelPool
+from jupyter_nvim.stats import AppStats
+from jupyter_nvim.throttle import OutputThrottle
+from jupyter_nvim.completion import Completer
+from jupyter_nvim.explorer import VariableExplorer
+from jupyter_nvim.notebook import Notebook, NotebookCell
+from jupyter_nvim.history import HistoryStore
+from jupyter_nvim.ansi import strip_ansi
+from jupyter_nvim.rpcserver import ControlServer
+from jupyter_nvim.health import HealthMonitor
 import os
 import sys, traceback
 import json
 import re
 from functools import partial, wraps
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import threading
+import time
 import traitlets
 
 import logging
@@ -39,19 +58,139 @@ __all__ = (
 
 
 
+class _LazyMsg():
+    # formats the message only when the log record is emitted
+    __slots__ = ('app', 'handled', 'channel', 'msg', 'count')
+
+    def __init__(self, app, handled, channel, msg):
+        self.app = app
+        self.handled = handled
+        self.channel = channel
+        self.msg = msg
+        self.count = app.stats.counts[channel], app.stats.counts['all']
+
+    def __str__(self):
+        return self.app.format_msg(self.handled, self.channel, self.msg, self.count)
+
+
 class JupyterNvimBufferApp(JupyterChildApp):
-    REQUEST = 0
 
-    def format_msg(self, handled, channel, msg):
+    flush_interval = traitlets.Float(0.05,
+        help='seconds to collect output lines before writing them to the buffers'
+    ).tag(config=True)
+    flush_lines = traitlets.Integer(1000,
+        help='number of pending output lines that forces a write to the buffers'
+    ).tag(config=True)
+    max_queued_executions = traitlets.Integer(100,
+        help='number of executions that may wait for the kernel, more are rejected'
+    ).tag(config=True)
+    max_inflight_executions = traitlets.Integer(2,
+        help='number of execute requests sent to the kernel before their replies arrive'
+    ).tag(config=True)
+    request_ttl = traitlets.Float(3600,
+        help='seconds after which a request without reply or idle status is expired'
+    ).tag(config=True)
+    max_tracked_requests = traitlets.Integer(1000,
+        help='number of unfinished requests tracked, the oldest are expired beyond it'
+    ).tag(config=True)
+    mime_priority = traitlets.List(traitlets.Unicode(),
+        ['image/png', 'text/markdown', 'text/plain', 'text/html'],
+        help='mimetypes of execute_result and display_data in order of preference'
+    ).tag(config=True)
+    mime_workers = traitlets.Integer(2,
+        help='number of threads converting rich output to text'
+    ).tag(config=True)
+    mime_cache_size = traitlets.Integer(128,
+        help='number of converted outputs cached by content hash'
+    ).tag(config=True)
+    ansi_highlight = traitlets.Bool(False,
+        help='show the colors of terminal escape sequences as highlights instead of dropping them'
+    ).tag(config=True)
+    traceback_max_frames = traitlets.Integer(100,
+        help='number of traceback frames put in the quickfix list, 0 for no limit'
+    ).tag(config=True)
+    max_buffer_lines = traitlets.Integer(0,
+        help='default line cap of out buffers, 0 for unlimited. '
+             'The oldest cells are trimmed into the spill file when the cap is hit'
+    ).tag(config=True)
+
+    output_rate = traitlets.Integer(2000,
+        help='stream lines per second written to the buffers, 0 for no limit'
+    ).tag(config=True)
+    output_burst = traitlets.Integer(10000,
+        help='stream lines that may be written at once before output_rate applies'
+    ).tag(config=True)
+    output_policy = traitlets.Enum(['drop', 'block', 'file'], 'drop',
+        help='what happens to stream output beyond output_rate: drop keeps its last '
+             'output_tail lines and marks the rest as elided, file writes it to a file, '
+             'block holds back the kernel client thread, which is shared by all kernels '
+             'with client_mode asyncio'
+    ).tag(config=True)
+    output_tail = traitlets.Integer(20,
+        help='last lines of dropped stream output that are written once the output slows down'
+    ).tag(config=True)
+    complete_cache_size = traitlets.Integer(256,
+        help='number of completion replies cached until the next execution'
+    ).tag(config=True)
+    complete_debounce = traitlets.Float(0.05,
+        help='seconds of typing pause before an asynchronous completion request is sent'
+    ).tag(config=True)
+    complete_budget = traitlets.Float(0.02,
+        help='seconds the omnifunc waits for the completion reply, a later reply '
+             'is shown asynchronously'
+    ).tag(config=True)
+    vars_page_size = traitlets.Integer(50,
+        help='rows of a variable fetched at once by the variable explorer'
+    ).tag(config=True)
+    history_file = traitlets.Unicode(
+        help='SQLite file keeping the executed code and its results, empty to disable the history'
+    ).tag(config=True)
+    history_backfill = traitlets.Bool(True,
+        help='on start, add the inputs the kernel already executed to the history'
+    ).tag(config=True)
+    history_page_size = traitlets.Integer(50,
+        help='executions shown at once by Jupyter history'
+    ).tag(config=True)
+    stats_window = traitlets.Integer(10,
+        help='seconds over which the message rates of Jupyter stats are averaged'
+    ).tag(config=True)
+
+    trace_level = traitlets.Integer(logging.DEBUG,
+        help='log level at which messages are dumped'
+    ).tag(config=True)
+    trace_channels = traitlets.List(traitlets.Unicode(),
+        help='channels whose messages are dumped, empty for all channels'
+    ).tag(config=True)
+    trace_msg_types = traitlets.List(traitlets.Unicode(),
+        help='msg_types that are dumped, empty for all msg_types'
+    ).tag(config=True)
+    trace_max_payload = traitlets.Integer(200,
+        help='dumped values longer than this number of characters are truncated, 0 for no limit'
+    ).tag(config=True)
+
+    def _history_file_default(self):
+        from jupyter_core.paths import jupyter_data_dir
+        return os.path.join(jupyter_data_dir(), 'nvim', 'history.sqlite')
+
+    def format_msg(self, handled, channel, msg, count=None):
         buf = io.StringIO()
         if handled:
             start, end = '=' * 4, '=' * 50
         else:
             start, end = '*' * 4, '*' * 50
-        print(start, channel, self.msg_count[channel], '-', self.msg_count['all'], end, file=buf)
-        msg_time = msg['header']['date']
+        if count is None:
+            count = self.stats.counts[channel], self.stats.counts['all']
+        print(start, channel, count[0], '-', count[1], end, file=buf)
         return self._format_msg(buf, channel, msg)
 
+    def _format_value(self, val):
+        if not isinstance(val, str):
+            val = str(val)
+        limit = self.trace_max_payload
+        if limit and len(val) > limit:
+            val = '{}... [{} chars]'.format(val[:limit], len(val))
+        return val
+
     def _format_msg(self, buf, channel, msg, ident=0):
         for key, val in sorted(msg.items()):
             print(' ' * ident, key, ':', end=' ', sep='', file=buf)
@@ -62,111 +201,347 @@ class JupyterNvimBufferApp(JupyterChildApp):
                 if val:
                     print(file=buf)
                     for ii, item in enumerate(val):
-                        print(' '* (ident + 4), item, file=buf)
+                        print(' '* (ident + 4), self._format_value(item), file=buf)
                 else:
                     print(val, file=buf)
             else:
-                print(val, file=buf)
+                print(self._format_value(val), file=buf)
         return buf.getvalue()
 
+    def trace_msg(self, handled, channel, msg):
+        if not self.log.isEnabledFor(self.trace_level):
+            return
+        if self._trace_channels and channel not in self._trace_channels:
+            return
+        if self._trace_msg_types and msg['header']['msg_type'] not in self._trace_msg_types:
+            return
+        self.log.log(self.trace_level, '%s', _LazyMsg(self, handled, channel, msg))
+
+    @traitlets.observe('trace_channels', 'trace_msg_types')
+    def _trace_filter_changed(self, change):
+        self._trace_channels = frozenset(self.trace_channels)
+        self._trace_msg_types = frozenset(self.trace_msg_types)
+
     def initialize(self, parent, identity, argv=None):
+        if parent.client_mode == 'asyncio':
+            from jupyter_nvim.aioclient import AsyncioKernelClient
+            self.kernel_client_class = AsyncioKernelClient
         super(JupyterNvimBufferApp, self).initialize(parent, identity, argv=argv)
 
         self.nvim = self.parent.nvim
+        self.childid = identity
         self._inspect_msg = None
-        self.msg_count = {
-            'shell': 0,
-            'iopub': 0,
-            'stdio': 0,
-            'hb': 0,
-            'all': 0,
-        }
-
-        self.execution_list = {}
-        self.waiting_list = {}
+        self._trace_filter_changed(None)
+        self.stats = AppStats(window=self.stats_window)
+        async_call = self._async_call = partial(self.stats.async_call, self.nvim)
+
+        self.tracker = RequestTracker(ttl=self.request_ttl, max_size=self.max_tracked_requests,
+                                      on_finish=self.finish_message)
+        self.scheduler = ExecutionScheduler(self.execute, self.log,
+                                            max_queued=self.max_queued_executions,
+                                            max_inflight=self.max_inflight_executions,
+                                            on_change=self._queue_changed)
+        self.completer = Completer(self._send_complete, self.tracker.cancel, self._deliver_completion,
+                                   self.log, cache_size=self.complete_cache_size,
+                                   debounce=self.complete_debounce, budget=self.complete_budget)
+        self.explorer = VariableExplorer(self._send_silent, partial(self._show_vars, identity),
+                                         self.log, page_size=self.vars_page_size)
+        # bufno -> Notebook shown in the buffer
+        self.notebooks = {}
+        self.history_store = HistoryStore(self.history_file, self.log) if self.history_file else None
+        # msgid of the history_request of the backfill, and parent msgid ->
+        # execution count of the executions whose results are recorded
+        self._backfill_msgid = None
+        self._history_counts = {}
+        self._kernel_session = None
+        self._run_executor = None
         self.obuf = set()
         self.ibuf = set()
         self.iobuf = set()
-        self.obuf_handler = OutBufMsgHandler(self.nvim, self.log)
-        self.iobuf_handler = OutBufMsgHandler(self.nvim, self.log)
+        self.spill = SpillFile('jupyter-nvim-{}-'.format(identity))
+        self.quickfix = QuickfixList(self.nvim, self.log, 'Jupyter {}'.format(identity),
+                                     max_frames=self.traceback_max_frames,
+                                     async_call=async_call)
+        self.renderer = MimeRenderer(self.log, priority=list(self.mime_priority),
+                                     max_workers=self.mime_workers,
+                                     cache_size=self.mime_cache_size)
+        self.throttle = None
+        if self.output_rate > 0:
+            self.throttle = OutputThrottle(rate=self.output_rate, burst=self.output_burst,
+                                           policy=self.output_policy, tail=self.output_tail,
+                                           prefix='jupyter-nvim-{}-output-'.format(identity))
+        # one handler renders every message once for all the out and inout buffers
+        self.out_handler = OutBufMsgHandler(self.nvim, self.log,
+                                            flush_interval=self.flush_interval,
+                                            flush_lines=self.flush_lines,
+                                            spill=self.spill,
+                                            renderer=self.renderer,
+                                            ansi_highlight=self.ansi_highlight,
+                                            quickfix=self.quickfix,
+                                            async_call=async_call,
+                                            throttle=self.throttle)
+        if parent.client_mode == 'asyncio':
+            # last, the messages buffered until now are handled right away
+            # by the loop thread
+            self.kernel_client.set_handlers(shell=self.on_shell_msg, iopub=self.on_iopub_msg,
+                                            stdin=self.on_stdin_msg, hb=self.on_hb_msg)
 
     def on_finish_kernel_info(self):
-        if self.obuf_handler:
-            self.obuf_handler.on_finish_kernel_info(self.kernel_info, self.pending_shell_msg, self.pending_iopub_msg)
+        if self.out_handler:
+            self.out_handler.on_finish_kernel_info(self.kernel_info, self.pending_shell_msg, self.pending_iopub_msg)
         self.pending_shell_msg.clear()
         self.pending_iopub_msg.clear()
+        if self.history_store is not None and self.history_backfill:
+            # session 0 is the current session of the kernel
+            self._backfill_msgid = self.history(raw=True, output=False, hist_access_type='range',
+                                                session=0, start=1, stop=None)
 
     def _get_valid_bufs(self, bufnos):
-        buffers = {buf.number : buf for buf in self.buffers if buf.number in bufnos}
-        return buffers
+        return self.parent.get_buffers(bufnos)
 
-    def register_out_buffer(self, *bufnos):
+    def register_out_buffer(self, *bufnos, max_lines=None):
+        if max_lines is None:
+            max_lines = self.max_buffer_lines
         valid_bufs = self._get_valid_bufs(bufnos)
         added = False
         for bufno, buf in valid_bufs.items():
             if bufno not in self.obuf:
                 self.obuf.add(bufno)
-                self.obuf_handler.bufs.append(buf)
+                self.out_handler.add_buffer(buf, max_lines=max_lines)
                 added = True
         return added
 
     def register_in_buffer(self, bufno):
         self.ibuf.add(bufno)
 
-    def register_io_buffer(self, bufno):
+    def register_inout_buffer(self, *bufnos):
         valid_bufs = self._get_valid_bufs(bufnos)
         added = False
-        for bufno, buf in valid_bufs:
+        for bufno, buf in valid_bufs.items():
             if bufno not in self.iobuf:
                 self.iobuf.add(bufno)
-                self.iobuf_handler.bufs.append(buf)
+                if bufno not in self.obuf:
+                    self.out_handler.add_buffer(buf)
                 added = True
         return added
 
+    register_io_buffer = register_inout_buffer
+
+    def open_notebook(self, path, buf):
+        notebook = Notebook.load(path)
+        buf[:] = notebook.render()
+        self.notebooks[buf.number] = notebook
+        return notebook
+
+    def save_notebook(self, buf):
+        notebook = self.notebooks[buf.number]
+        notebook.sync(buf[:])
+        notebook.save()
+        return notebook
+
+    def run_notebook_cell(self, buf, row):
+        # outputs of the execution are written back into the cell
+        notebook = self.notebooks[buf.number]
+        notebook.sync(buf[:])
+        cell = notebook.cell_at(row)
+        if cell is None or cell.cell_type != 'code':
+            return False
+        return self.submit(cell.source, label=cell)
+
+    def _record_history(self, pid, msg):
+        # iopub messages of all the clients of the kernel are recorded,
+        # keyed by the session id of the kernel
+        msg_type = msg['header']['msg_type']
+        content = msg['content']
+        session = self._kernel_session = msg['header'].get('session', '')
+        if msg_type == 'execute_input':
+            self._history_counts[pid] = content['execution_count']
+            self.history_store.add_input(session, content['execution_count'], content['code'])
+        elif msg_type == 'execute_result':
+            self.history_store.add_output(session, content['execution_count'], 'result',
+                                          content['data'].get('text/plain', ''))
+        elif msg_type == 'error' and pid in self._history_counts:
+            text = strip_ansi('\n'.join(content.get('traceback') or [])) or \
+                '{}: {}'.format(content['ename'], content['evalue'])
+            self.history_store.add_output(session, self._history_counts[pid], 'error', text)
+        elif msg_type == 'status' and content['execution_state'] == 'idle':
+            self._history_counts.pop(pid, None)
+
+    def _backfill_history(self, msg):
+        session = msg['header'].get('session', '')
+        content = msg['content']
+        if content.get('status') != 'ok':
+            self.log.warning('no history to backfill: %s', content.get('evalue', content.get('status')))
+            return
+        count = 0
+        for _, line_number, source in content.get('history', []):
+            self.history_store.add_input(session, line_number, source, backfill=True)
+            count += 1
+        self.log.info('%d inputs of the kernel added to the history', count)
+
+    def show_history(self, query=None, page=0, current_session=False, execution_count=None):
+        # lines of a page of the history, newest first
+        self.history_store.flush()
+        session = self._kernel_session if current_session else None
+        entries = self.history_store.search(query, session=session, execution_count=execution_count,
+                                            limit=self.history_page_size,
+                                            offset=page * self.history_page_size)
+        return self.history_store.format(entries)
+
+    def _notebook_output(self, pid, msg_type, content):
+        cell = self.scheduler.label(pid)
+        if not isinstance(cell, NotebookCell):
+            return
+        if msg_type == 'execute_input':
+            cell.clear_outputs(content['execution_count'])
+        else:
+            cell.add_output(msg_type, content)
+
+    def unregister_buffer(self, bufno):
+        self.notebooks.pop(bufno, None)
+        if bufno in self.obuf or bufno in self.iobuf:
+            self.out_handler.remove_buffer(bufno)
+        self.obuf.discard(bufno)
+        self.iobuf.discard(bufno)
+        self.ibuf.discard(bufno)
+
     def output(self, msg):
         self.log.info(msg)
 
-    def finish_message(self, pid):
-        del self.waiting_list[pid]
-        self.log.info('message %s finished', pid)
+    def finish_message(self, pid, state):
+        self.log.info('message %s %s', pid, state)
+        label = self.scheduler.done(pid)
+        if label is not None:
+            self.log.info('%s %s', label, state)
+
+    def submit(self, code, label=None):
+        # frees the execution slots held by requests whose messages were lost
+        self.tracker.expire()
+        try:
+            return self.scheduler.submit(code, label)
+        except QueueFull as ex:
+            self.log.error('execution rejected: %s', ex)
+            return False
+
+    def on_kernel_restarted(self):
+        # the requests sent to the dead kernel never finish, cancelling them
+        # frees their slots and sends the queued executions to the new kernel
+        inflight = self.scheduler.inflight()
+        for msgid in inflight:
+            if not self.tracker.cancel(msgid):
+                self.scheduler.done(msgid)
+        self.log.warning('kernel restarted, %d running executions lost, %d queued kept',
+                         len(inflight), self.queue_depth)
+        self.out_handler.append('[kernel restarted, {} running executions lost]'.format(len(inflight)))
+
+    def cancel(self, interrupt=False):
+        count = self.scheduler.cancel()
+        self.log.info('%d pending executions cancelled', count)
+        if interrupt:
+            if self.kernel_manager is not None:
+                self.kernel_manager.interrupt_kernel()
+            elif not self.parent.interrupt_pooled_kernel(self):
+                self.log.error('cannot interrupt a kernel not started by this app')
+        return count
+
+    def _send_complete(self, code, cursor_pos):
+        return self.complete(code, cursor_pos=cursor_pos)
+
+    def _deliver_completion(self, prefix, result):
+        self._async_call(self.nvim.call, 'JupyterCompleteDone', prefix, result)
+
+    def _send_silent(self, code, user_expressions):
+        return self.execute(code, silent=True, store_history=False, user_expressions=user_expressions)
+
+    def _show_vars(self, childid, lines, name, page):
+        self._async_call(self.nvim.call, 'JupyterShowVars', childid, lines, name or '', page)
+
+    @property
+    def queue_depth(self):
+        return self.scheduler.depth
+
+    def _queue_changed(self, depth):
+        self.parent.publish_queue_depth()
+
+    def run_lines(self, lines, cells=False):
+        # joining, splitting and sending large ranges is done in a worker
+        # thread, one thread per child app so that runs keep their order
+        if self._run_executor is None:
+            self._run_executor = ThreadPoolExecutor(max_workers=1)
+        self._run_executor.submit(self._run_lines, lines, cells)
+
+    def _run_lines(self, lines, cells):
+        try:
+            codes = split_cells(lines) if cells else ['\n'.join(lines)]
+            for ii, code in enumerate(codes):
+                label = 'cell {}/{}'.format(ii + 1, len(codes)) if cells else None
+                self.submit(code, label)
+        except Exception:
+            self.log.exception('failed to run %d lines', len(lines))
 
     def handle_msg(self, channel, msg, **kwargs):
         if isinstance(msg, float):
-            print(channel, msg)
-        self.msg_count[channel] += 1
-        self.msg_count['all'] += 1
+            # a heart beat delay, not a message. stdout is the rpc channel
+            self.log.debug('%s %f', channel, msg)
+            return
+        self.stats.msg(channel, msg, own=kwargs.get('own', False))
         if self._inspect_msg:
             self._inspect_msg(msg)
 
         handled = False
-        if self.obuf_handler:
-            handled = self.obuf_handler(channel, msg, **kwargs)
-        self.log.info(self.format_msg(handled, channel, msg))
+        if self.out_handler:
+            start = time.perf_counter()
+            handled = self.out_handler(channel, msg, **kwargs)
+            if handled:
+                self.stats.handler(channel, msg['header']['msg_type'], time.perf_counter() - start)
+        self.trace_msg(handled, channel, msg)
 
     @catch_exception
     def on_shell_msg(self, msg):
         pid = self.get_parent_id(msg)
         own = self.is_waiting_for(pid)
         self.handle_msg('shell', msg, own=own)
+        if pid is not None and pid == self._backfill_msgid:
+            self._backfill_msgid = None
+            self._backfill_history(msg)
+        elif msg['header']['msg_type'] == 'complete_reply':
+            # also the late replies of superseded requests, for the cache
+            self.completer.on_reply(pid, msg['content'])
+        elif pid in self.explorer:
+            self.explorer.on_reply(pid, msg['content'])
         if own:
             assert msg['header']['msg_type'].endswith('_reply')
-            self.waiting_list[pid] += 1
-            if self.waiting_list[pid] >= 2:
-                self.finish_message(pid)
+            self.tracker.reply(pid)
 
     @catch_exception
     def on_iopub_msg(self, msg):
         pid = self.get_parent_id(msg)
         own = self.is_waiting_for(pid)
         self.handle_msg('iopub', msg, own=own)
+        msg_type = msg['header']['msg_type']
+        if self.history_store is not None:
+            self._record_history(pid, msg)
+        if msg_type == 'status' and self.parent.health is not None:
+            # of all the executions, a busy kernel answers heart beats later
+            self.parent.health.set_execution_state(self.childid, msg['content']['execution_state'])
+        control = self.parent.control_server
+        if control is not None and control.subscribed(self.childid):
+            label = self.scheduler.label(pid) if own else None
+            control.publish(self.childid, msg_type, msg['content'], pid,
+                            label if isinstance(label, str) else None)
+        if msg_type == 'execute_input':
+            # any execution, also of other clients, may change what completes
+            # and the variables
+            self.completer.invalidate()
+            self.explorer.set_execution_count(msg['content']['execution_count'])
         if own:
-            # finished
-            if msg['header']['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
-                self.waiting_list[pid] += 1
-            if self.waiting_list[pid] >= 2:
-                self.finish_message(pid)
-        if msg['header']['msg_type'] == 'execute_input':
-            self.execution_list[pid] = msg['content']['execution_count']
+            if self.notebooks:
+                self._notebook_output(pid, msg_type, msg['content'])
+            if msg_type == 'status' and msg['content']['execution_state'] == 'idle':
+                # finished
+                self.tracker.idle(pid)
+            elif msg_type == 'execute_input':
+                self.tracker.set_execution_count(pid, msg['content']['execution_count'])
 
     @catch_exception
     def on_stdin_msg(self, msg):
@@ -174,13 +549,17 @@ class JupyterNvimBufferApp(JupyterChildApp):
 
     @catch_exception
     def on_hb_msg(self, msg):
-        self.set_state('dead')
-        self.log.warning('heart beat: %f', msg)
+        # msg is the time since the last heart beat
+        if self.parent.health is not None:
+            self.parent.health.on_missed_beat(self.childid, msg)
+        else:
+            self.set_state('dead')
+            self.log.warning('heart beat: %f', msg)
 
     def shell_send_callback(self, method, msgid):
-        assert msgid not in self.waiting_list
+        assert msgid not in self.tracker
         self.log.info('waiting for %s', msgid)
-        self.waiting_list[msgid] = self.REQUEST
+        self.tracker.add(msgid)
 
     def get_parent_id(self, msg):
         parent_header = msg.get('parent_header')
@@ -188,7 +567,7 @@ class JupyterNvimBufferApp(JupyterChildApp):
             return parent_header['msg_id']
 
     def is_waiting_for(self, parent_id):
-        return parent_id in self.waiting_list
+        return parent_id in self.tracker
 
     @property
     def buffers(self):
@@ -199,6 +578,49 @@ class JupyterNvimApp(JupyterContainerApp):
 
     child_app_factory = JupyterNvimBufferApp
     classes = JupyterContainerApp.classes + [JupyterNvimBufferApp]
+    aliases = dict(JupyterContainerApp.aliases, **{
+        'history-file': 'JupyterNvimBufferApp.history_file',
+    })
+
+    client_mode = traitlets.Enum(['threaded', 'asyncio'], 'threaded',
+        help='threaded runs an ioloop thread and a heartbeat thread per kernel, '
+             'asyncio runs the channels of all kernels in one asyncio event loop'
+    ).tag(config=True)
+    kernel_pool_size = traitlets.Integer(0,
+        help='number of idle kernels started ahead per kernel spec, 0 to disable the pool'
+    ).tag(config=True)
+    kernel_pool_idle_timeout = traitlets.Float(600,
+        help='seconds after which an idle kernel of the pool is shut down, 0 to keep it'
+    ).tag(config=True)
+    health_interval = traitlets.Float(1.0,
+        help='seconds between the heart beat pings of the health monitor, 0 to disable it'
+    ).tag(config=True)
+    health_min_timeout = traitlets.Float(0.5,
+        help='seconds, lower bound of the timeout of a ping, which adapts to the round trip times'
+    ).tag(config=True)
+    health_max_timeout = traitlets.Float(10.0,
+        help='seconds, upper bound of the timeout of a ping, and the timeout before the first reply'
+    ).tag(config=True)
+    health_busy_factor = traitlets.Float(4.0,
+        help='the timeout of a ping is multiplied by this while the kernel is busy'
+    ).tag(config=True)
+    health_max_misses = traitlets.Integer(3,
+        help='missed pings in a row after which a kernel is dead'
+    ).tag(config=True)
+    health_auto_restart = traitlets.Bool(True,
+        help='restart the dead kernels started by this app, keeping the queued executions'
+    ).tag(config=True)
+    health_history = traitlets.Integer(300,
+        help='number of round trip times kept per child app, see Jupyter stats --json'
+    ).tag(config=True)
+    control_socket = traitlets.Unicode(
+        help='Unix socket on which scripts can list the child apps, submit code and '
+             'subscribe to the output, empty to disable. Its path is in g:jupyter_nvim_control_socket'
+    ).tag(config=True)
+
+    def _control_socket_default(self):
+        from jupyter_core.paths import jupyter_runtime_dir
+        return os.path.join(jupyter_runtime_dir(), 'nvim-control-{}.sock'.format(os.getpid()))
 
     def _log_default(self):
         from traitlets import log
@@ -217,20 +639,202 @@ class JupyterNvimApp(JupyterContainerApp):
         super(JupyterNvimApp, self).initialize(argv=argv)
         self.log.info('JupyterNvimApp Initialized')
         self._current = None
+        # bufno -> Buffer, kept up to date by the BufNew/BufWipeout autocmds
+        self._buffer_code = next(code for code, cls in nvim.types.items() if cls is Buffer)
+        self.buffer_index = {buf.number: buf for buf in nvim.buffers}
+        self.watch_buffers()
+        # childid -> id of the pooled kernel it runs on, shut down with the child app
+        self._pooled_kernels = {}
+        self.kernel_pool = None
+        if self.kernel_pool_size > 0:
+            self.kernel_pool = KernelPool(self.kernel_manager, self.log,
+                                          size=self.kernel_pool_size,
+                                          idle_timeout=self.kernel_pool_idle_timeout)
+            self.kernel_pool.fill(self.kernel_manager.default_kernel_name)
+        self.control_server = None
+        if self.control_socket:
+            self.start_control_server()
+        self.health = None
+        if self.health_interval > 0:
+            self.health = HealthMonitor(self.log, self._kernel_dead, self._kernel_alive,
+                                        interval=self.health_interval,
+                                        min_timeout=self.health_min_timeout,
+                                        max_timeout=self.health_max_timeout,
+                                        max_misses=self.health_max_misses,
+                                        busy_factor=self.health_busy_factor,
+                                        history=self.health_history)
+
+    def start_control_server(self):
+        methods = {
+            'list': self.describe_child_apps,
+            'submit': lambda childid, code, label=None: self.child_app(childid).submit(code, label),
+            'cancel': lambda childid, interrupt=False: self.child_app(childid).cancel(interrupt=interrupt),
+            'stats': self.stats,
+        }
+        server = ControlServer(self.control_socket, self.log, methods)
+        try:
+            os.makedirs(os.path.dirname(self.control_socket), exist_ok=True)
+            server.start()
+        except OSError as ex:
+            self.log.error('cannot start the control server on %s: %s', self.control_socket, ex)
+            return
+        self.control_server = server
+        self.nvim.vars['jupyter_nvim_control_socket'] = self.control_socket
+
+    def describe_child_apps(self):
+        return {childid: {'current': childid == self._current,
+                          'queue_depth': bufapp.queue_depth,
+                          'connection_file': bufapp.connection_file}
+                for childid, bufapp in self._child_apps.items()}
 
     @property
     def buffers(self):
         return self.nvim.buffers
 
+    def watch_buffers(self):
+        # keeps buffer_index up to date, through on_buf_add and on_buf_delete.
+        # BufNew and BufWipeout, since BufAdd and BufDelete follow the buffer
+        # list: unlisted buffers are not added, :bd and nobuflisted delete
+        notify = "call rpcnotify({}, '{{}}', +expand('<abuf>'))".format(self.nvim.channel_id)
+        self.nvim.command('augroup jupyter_nvim_buffers')
+        self.nvim.command('autocmd!')
+        self.nvim.command('autocmd BufNew * ' + notify.format('jupyter_nvim_buf_add'))
+        self.nvim.command('autocmd BufWipeout * ' + notify.format('jupyter_nvim_buf_delete'))
+        self.nvim.command('augroup END')
+
+    def _buffer(self, bufno):
+        # build the Buffer from its handle instead of asking nvim for all buffers
+        return Buffer(self.nvim, (self._buffer_code, msgpack.packb(bufno)))
+
+    def get_buffers(self, bufnos):
+        buffers = {}
+        for bufno in map(int, bufnos):
+            buf = self.buffer_index.get(bufno)
+            if buf is None:
+                # missed by the autocmds, or not a buffer
+                buf = self._buffer(bufno)
+                if not buf.valid:
+                    self.log.warning('buffer %d does not exist', bufno)
+                    continue
+                self.buffer_index[bufno] = buf
+            buffers[bufno] = buf
+        return buffers
+
+    def on_buf_add(self, bufno):
+        if bufno not in self.buffer_index:
+            self.buffer_index[bufno] = self._buffer(bufno)
+
+    def on_buf_delete(self, bufno):
+        if self.buffer_index.pop(bufno, None) is not None:
+            for bufapp in self._child_apps.values():
+                bufapp.unregister_buffer(bufno)
+
     def start_child_app(self, childid, argv=None, **kwargs):
         # if not any(buf.number == childid for buf in self.buffers):
         #     self.log.error('chilid should be a buf number')
         #     return
-        bufapp = super(JupyterNvimApp, self).start_child_app(childid, argv, **kwargs)
+        kernel_id = None
+        kernel_name = self._pool_kernel_name(argv)
+        if kernel_name is not None:
+            kernel_id = self.kernel_pool.take(kernel_name)
+        if kernel_id is not None:
+            connection_file = self.kernel_manager.get_kernel(kernel_id).connection_file
+            argv = ['--existing={}'.format(connection_file)]
+        try:
+            bufapp = super(JupyterNvimApp, self).start_child_app(childid, argv, **kwargs)
+        except Exception:
+            if kernel_id is not None:
+                self.kernel_manager.shutdown_kernel(kernel_id, now=True)
+            raise
+        if kernel_id is not None:
+            self._pooled_kernels[childid] = kernel_id
+        if self.health is not None:
+            self.health.add(childid, bufapp.kernel_client)
         self.log.info('Started child app %d, connection file %s', childid, bufapp.connection_file)
         self.set_current(childid)
         return bufapp
 
+    def _pool_kernel_name(self, argv):
+        # the kernel spec to take from the pool, None if argv asks for
+        # anything else than a new kernel of some spec
+        if self.kernel_pool is None:
+            return None
+        argv = list(argv or [])
+        if not argv:
+            return self.kernel_manager.default_kernel_name
+        if len(argv) == 1 and argv[0].startswith('--kernel='):
+            return argv[0][len('--kernel='):]
+        if len(argv) == 2 and argv[0] == '--kernel':
+            return argv[1]
+        return None
+
+    def interrupt_pooled_kernel(self, bufapp):
+        childid = next((childid for childid, app in self._child_apps.items() if app is bufapp), None)
+        kernel_id = self._pooled_kernels.get(childid)
+        if kernel_id is None:
+            return False
+        self.kernel_manager.interrupt_kernel(kernel_id)
+        return True
+
+    def _kernel_dead(self, childid):
+        # called by the health monitor, returns True if the kernel is restarted
+        bufapp = self._child_apps.get(childid)
+        if bufapp is None:
+            return False
+        bufapp.set_state('dead')
+        if not self.health_auto_restart:
+            return False
+        return self.restart_child_kernel(childid)
+
+    def _kernel_alive(self, childid):
+        # called by the health monitor when a dead kernel answers again
+        bufapp = self._child_apps.get(childid)
+        if bufapp is not None:
+            bufapp.set_state('alive')
+
+    def restart_child_kernel(self, childid):
+        bufapp = self.child_app(childid)
+        kernel_id = self._pooled_kernels.get(childid)
+        if bufapp.kernel_manager is not None:
+            bufapp.kernel_manager.restart_kernel(now=True)
+        elif kernel_id is not None:
+            self.kernel_manager.restart_kernel(kernel_id, now=True)
+        else:
+            self.log.error('the kernel of child app %s was not started by this app, not restarted', childid)
+            return False
+        self.log.warning('restarted the kernel of child app %s', childid)
+        bufapp.set_state('alive')
+        bufapp.on_kernel_restarted()
+        return True
+
+    def quit_app(self, childid):
+        if self.health is not None:
+            self.health.remove(childid)
+        bufapp = self._child_apps.get(childid)
+        super(JupyterNvimApp, self).quit_app(childid)
+        if bufapp is not None and bufapp.history_store is not None:
+            bufapp.history_store.close()
+        kernel_id = self._pooled_kernels.pop(childid, None)
+        if kernel_id is not None:
+            self.kernel_manager.shutdown_kernel(kernel_id)
+
+    def quit(self):
+        if self.kernel_pool is not None:
+            self.kernel_pool.shutdown()
+        if self.control_server is not None:
+            self.control_server.close()
+            self.control_server = None
+        if self.health is not None:
+            self.health.stop()
+        for bufapp in self._child_apps.values():
+            if bufapp.history_store is not None:
+                bufapp.history_store.close()
+        super(JupyterNvimApp, self).quit()
+        for kernel_id in self._pooled_kernels.values():
+            if kernel_id in self.kernel_manager:
+                self.kernel_manager.shutdown_kernel(kernel_id, now=True)
+        self._pooled_kernels.clear()
+
     def set_current(self, childid):
         if childid in self._child_apps:
             self._current = childid
@@ -240,3 +844,48 @@ class JupyterNvimApp(JupyterContainerApp):
     def current_child(self):
         return self._current
 
+    def publish_queue_depth(self):
+        # g:jupyter_nvim_queue_depth maps childid to the number of queued and
+        # running executions, for use in the statusline
+        depth = {str(childid): bufapp.queue_depth for childid, bufapp in self._child_apps.items()}
+        self.nvim.async_call(self._set_queue_depth, depth)
+
+    def _set_queue_depth(self, depth):
+        self.nvim.vars['jupyter_nvim_queue_depth'] = depth
+
+    def complete(self, prefix):
+        # for the omnifunc, {} if nothing can be completed in time. The
+        # budget is not waited for while executions of the app are running
+        bufapp = self._child_apps.get(self._current)
+        if bufapp is None:
+            return {}
+        return bufapp.completer.complete(prefix, wait=not bufapp.queue_depth) or {}
+
+    def complete_async(self, prefix):
+        bufapp = self._child_apps.get(self._current)
+        if bufapp is not None:
+            bufapp.completer.complete_async(prefix)
+
+    def stats(self, childid=None):
+        # {childid: AppStats.as_dict()} of one or all child apps
+        if childid is not None:
+            bufapps = {childid: self.child_app(childid)}
+        else:
+            bufapps = self._child_apps
+        stats = {}
+        for childid, bufapp in bufapps.items():
+            stats[childid] = bufapp.stats.as_dict()
+            stats[childid]['requests'] = bufapp.tracker.stats
+            if bufapp.throttle is not None:
+                stats[childid]['throttle'] = bufapp.throttle.stats
+            if self.health is not None:
+                stats[childid]['health'] = self.health.stats(childid)
+        return stats
+
+    def child_app(self, childid=None):
+        if childid is None:
+            childid = self._current
+        if childid not in self._child_apps:
+            raise ValueError('child app with id {} does not exist'.format(childid))
+        return self._child_apps[childid]
+
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+__all__ = (
+    'KernelPool',
+)
+
+class KernelPool():
+    '''Idle kernels started ahead of time by the multi kernel manager.
+
+    ``take(kernel_name)`` hands out a warm kernel id, or None if there is
+    none, and refills the pool of that kernel spec in the background. At
+    most ``size`` idle kernels are kept per kernel spec, and kernels idle
+    for more than ``idle_timeout`` seconds are shut down. A drained spec is
+    only refilled by its next ``take``.
+    '''
+    def __init__(self, kernel_manager, log, size=1, idle_timeout=600):
+        self.kernel_manager = kernel_manager
+        self.log = log
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # kernel_name -> deque of (kernel_id, time started)
+        self._idle = {}
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._closed = False
+
+    def take(self, kernel_name):
+        with self._lock:
+            idle = self._idle.get(kernel_name)
+            kernel_id = idle.popleft()[0] if idle else None
+        self.fill(kernel_name)
+        if kernel_id is not None:
+            self.log.info('kernel %s of %s taken from the pool', kernel_id, kernel_name)
+        return kernel_id
+
+    def fill(self, kernel_name):
+        with self._lock:
+            if self._closed or kernel_name in self._filling:
+                return
+            self._filling.add(kernel_name)
+        thread = threading.Thread(target=self._fill, args=(kernel_name,), daemon=True)
+        thread.start()
+
+    def _fill(self, kernel_name):
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.setdefault(kernel_name, deque())
+                    if self._closed or len(idle) >= self.size:
+                        break
+                kernel_id = self.kernel_manager.start_kernel(kernel_name=kernel_name)
+                with self._lock:
+                    closed = self._closed
+                    if not closed:
+                        idle.append((kernel_id, time.monotonic()))
+                if closed:
+                    self.kernel_manager.shutdown_kernel(kernel_id, now=True)
+                    break
+                self.log.info('kernel %s of %s started in the pool', kernel_id, kernel_name)
+                self._schedule_reap()
+        except Exception:
+            self.log.exception('failed to start a kernel of %s for the pool', kernel_name)
+        finally:
+            with self._lock:
+                self._filling.discard(kernel_name)
+
+    def _schedule_reap(self):
+        with self._lock:
+            if self._reaper is not None or self._closed or not self.idle_timeout:
+                return
+            self._reaper = threading.Timer(self.idle_timeout / 2, self._reap)
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            self._reaper = None
+            for idle in self._idle.values():
+                while idle and idle[0][1] < deadline:
+                    expired.append(idle.popleft()[0])
+            remaining = any(self._idle.values())
+        for kernel_id in expired:
+            self.log.info('shutting down kernel %s idle in the pool', kernel_id)
+            self.kernel_manager.shutdown_kernel(kernel_id, now=True)
+        if remaining:
+            self._schedule_reap()
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            if self._reaper is not None:
+                self._reaper.cancel()
+            kernel_ids = [kernel_id for idle in self._idle.values() for kernel_id, _ in idle]
+            self._idle.clear()
+        for kernel_id in kernel_ids:
+            self.kernel_manager.shutdown_kernel(kernel_id, now=True)
@@ -0,0 +1,105 @@
+import os
+import re
+from jupyter_nvim.ansi import strip_ansi
+
+__all__ = (
+    'QuickfixList',
+    'parse_traceback',
+)
+
+# first line of a frame: 'File /path/x.py:3, in f(x)' (IPython >= 8),
+# '/path/x.py in f(x)' and '<ipython-input-1-...> in <module>()' (older)
+_file_frame = re.compile(r'^File (?P<filename>.+?):(?P<lnum>\d+)(?:, in (?P<func>.*))?$')
+_old_frame = re.compile(r'^(?P<filename>\S+) in (?P<func>\S.*)$')
+_cell_frame = re.compile(r'^(?P<cell>(?:Cell|Input) In ?\[\d*\]), line (?P<lnum>\d+)(?:, in (?P<func>.*))?$')
+_current_line = re.compile(r'^-*> ?\s*(?P<lnum>\d+)\s?(?P<code>.*)$')
+
+def _parse_frame(entry):
+    lines = strip_ansi(entry).strip('\n').split('\n')
+    first = lines[0].strip()
+    code = ''
+    lnum = None
+    for line in lines[1:]:
+        match = _current_line.match(line)
+        if match:
+            lnum = int(match.group('lnum'))
+            code = match.group('code').strip()
+            break
+    for regex in (_file_frame, _cell_frame, _old_frame):
+        match = regex.match(first)
+        if match:
+            break
+    else:
+        return None
+    groups = match.groupdict()
+    if groups.get('lnum'):
+        lnum = int(groups['lnum'])
+    func = groups.get('func') or ''
+    filename = groups.get('filename')
+    if groups.get('cell') or filename.startswith('<'):
+        # code of a cell, there is no file to jump to
+        location = groups.get('cell') or filename
+        text = ' '.join(part for part in (func, code) if part)
+        return {'text': '{}, line {}: {}'.format(location, lnum, text), 'valid': 0}
+    text = ': '.join(part for part in (func, code) if part)
+    return {'filename': os.path.expanduser(filename), 'lnum': lnum or 0, 'text': text}
+
+def parse_traceback(traceback, max_frames=100):
+    '''Parse the traceback of an error message into quickfix items.
+
+    Runs of identical frames, as produced by deep recursion, are collapsed
+    into one frame and a note, and at most ``max_frames`` frames are kept:
+    the first and the last half of them.
+    '''
+    frames = []
+    repeats = []
+    for entry in traceback[1:-1]:
+        item = _parse_frame(entry)
+        if item is None:
+            # e.g. '[... skipping similar frames: ...]'
+            text = strip_ansi(entry).strip()
+            if text:
+                frames.append({'text': text, 'valid': 0})
+                repeats.append(0)
+        elif frames and frames[-1] == item:
+            repeats[-1] += 1
+        else:
+            frames.append(item)
+            repeats.append(0)
+
+    items = []
+    for item, repeat in zip(frames, repeats):
+        items.append(item)
+        if repeat:
+            items.append({'text': '[previous frame repeated {} more times]'.format(repeat), 'valid': 0})
+    if max_frames and len(items) > max_frames:
+        head = max_frames // 2
+        tail = max_frames - head
+        omitted = len(items) - max_frames
+        items = items[:head] + [{'text': '[{} frames omitted]'.format(omitted), 'valid': 0}] + items[-tail:]
+    if traceback:
+        message = strip_ansi(traceback[-1]).strip()
+        items.append({'text': message, 'valid': 0})
+    return items
+
+class QuickfixList():
+    '''The quickfix list of one child app, reused for every error.
+
+    The traceback is parsed on the calling thread and set with a single
+    call to JupyterSetQfList (plugin/jupyter.vim), which replaces the list
+    titled ``title`` if it still exists instead of pushing a new one.
+    '''
+    def __init__(self, nvim, log, title, max_frames=100, async_call=None):
+        self.nvim = nvim
+        self.async_call = async_call or nvim.async_call
+        self.log = log
+        self.title = title
+        self.max_frames = max_frames
+        self.qfid = 0
+
+    def set_traceback(self, traceback):
+        items = parse_traceback(traceback, self.max_frames)
+        self.async_call(self._set_items, items)
+
+    def _set_items(self, items):
+        self.qfid = self.nvim.call('JupyterSetQfList', self.qfid, self.title, items)
@@ -0,0 +1,125 @@
+import itertools
+import socket
+import threading
+from concurrent.futures import Future
+import msgpack
+
+__all__ = (
+    'ControlClient',
+    'ControlError',
+)
+
+REQUEST = 0
+RESPONSE = 1
+NOTIFICATION = 2
+
+class ControlError(Exception):
+    pass
+
+class ControlClient():
+    '''Client of the control server of the plugin host, see
+    ``g:jupyter_nvim_control_socket`` for its path.
+
+    ``call`` waits for the response, ``call_async`` returns a Future so
+    that requests can be pipelined on the one connection, and ``batch``
+    sends a list of requests in one write. ``subscribe(childid, callback)``
+    has ``callback(msg_type, content, parent_id, label)`` called, in the
+    thread reading the responses, for the iopub messages of the child app.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self._ids = itertools.count()
+        # msgid -> Future
+        self._pending = {}
+        # childid -> callback
+        self._callbacks = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name='jupyter-nvim-control-client', daemon=True)
+        self._reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method, params):
+        msgid = next(self._ids)
+        future = Future()
+        self._pending[msgid] = future
+        return future, msgpack.packb([REQUEST, msgid, method, list(params)], use_bin_type=True)
+
+    def call_async(self, method, *params):
+        future, data = self._request(method, params)
+        self._send(data)
+        return future
+
+    def _send(self, data):
+        try:
+            with self._send_lock:
+                self.sock.sendall(data)
+        except OSError as ex:
+            raise ControlError('connection lost: {}'.format(ex))
+
+    def call(self, method, *params, timeout=None):
+        return self.call_async(method, *params).result(timeout)
+
+    def batch(self, calls, timeout=None):
+        '''Sends the (method, params) of ``calls`` in one write and returns
+        their results, raising the first error.'''
+        futures, chunks = [], []
+        for method, params in calls:
+            future, data = self._request(method, params)
+            futures.append(future)
+            chunks.append(data)
+        self._send(b''.join(chunks))
+        return [future.result(timeout) for future in futures]
+
+    def subscribe(self, childid, callback):
+        self._callbacks[childid] = callback
+        return self.call('subscribe', childid)
+
+    def unsubscribe(self, childid):
+        result = self.call('unsubscribe', childid)
+        self._callbacks.pop(childid, None)
+        return result
+
+    def _read_loop(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        error = ControlError('connection closed')
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                unpacker.feed(data)
+                for msg in unpacker:
+                    if msg[0] == RESPONSE:
+                        _, msgid, err, result = msg
+                        future = self._pending.pop(msgid, None)
+                        if future is None:
+                            continue
+                        if err is not None:
+                            future.set_exception(ControlError(*err))
+                        else:
+                            future.set_result(result)
+                    elif msg[0] == NOTIFICATION and msg[1] == 'output':
+                        childid, msg_type, content, parent_id, label = msg[2]
+                        callback = self._callbacks.get(childid)
+                        if callback is not None:
+                            callback(msg_type, content, parent_id, label)
+        except OSError as ex:
+            error = ControlError('connection lost: {}'.format(ex))
+        for future in list(self._pending.values()):
+            future.set_exception(error)
+        self._pending.clear()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join(5)
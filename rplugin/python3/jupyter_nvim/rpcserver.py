@@ -0,0 +1,226 @@
+import os
+import queue
+import socket
+import threading
+import msgpack
+
+__all__ = (
+    'ControlServer',
+)
+
+# msgpack-rpc message types, as used by nvim
+REQUEST = 0
+RESPONSE = 1
+NOTIFICATION = 2
+
+def pack(obj):
+    # datetimes of the message headers, and anything else msgpack does not
+    # know, are sent as strings
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+class _Connection():
+    # one client: a thread reading and dispatching its requests, and a
+    # thread writing the responses and notifications queued for it
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.subscriptions = set()
+        self.dropped = 0
+        self._out = queue.Queue(server.max_pending)
+        self._reader = threading.Thread(target=self._read_loop, name='jupyter-nvim-control-read', daemon=True)
+        self._writer = threading.Thread(target=self._write_loop, name='jupyter-nvim-control-write', daemon=True)
+
+    def start(self):
+        self._reader.start()
+        self._writer.start()
+
+    def _read_loop(self):
+        unpacker = msgpack.Unpacker(raw=False, max_buffer_size=self.server.max_request_size)
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                unpacker.feed(data)
+                # the responses to all the requests of one read go out in one write
+                responses = [self.server.dispatch(self, request) for request in unpacker]
+                responses = [response for response in responses if response is not None]
+                if responses:
+                    self._out.put(b''.join(responses))
+        except (OSError, ValueError, msgpack.UnpackException) as ex:
+            self.server.log.warning('control connection closed: %s', ex)
+        finally:
+            self.close()
+
+    def _write_loop(self):
+        while True:
+            chunks = [self._out.get()]
+            while chunks[-1] is not None:
+                try:
+                    chunks.append(self._out.get_nowait())
+                except queue.Empty:
+                    break
+            data = b''.join(chunk for chunk in chunks if chunk is not None)
+            try:
+                if data:
+                    self.sock.sendall(data)
+            except OSError:
+                break
+            if chunks[-1] is None:
+                break
+        self.sock.close()
+
+    def notify(self, data):
+        try:
+            self._out.put_nowait(data)
+        except queue.Full:
+            # a client that does not read its notifications does not hold
+            # back the kernel client thread
+            self.dropped += 1
+            if self.dropped == 1:
+                self.server.log.warning('control client too slow, dropping notifications')
+
+    def close(self):
+        if self.server.remove(self):
+            self.subscriptions.clear()
+            try:
+                self._out.put_nowait(None)
+                how = socket.SHUT_RD
+            except queue.Full:
+                # the writer is stuck on a client that does not read
+                how = socket.SHUT_RDWR
+            try:
+                self.sock.shutdown(how)
+            except OSError:
+                pass
+
+class ControlServer():
+    '''msgpack-rpc server on a Unix socket, for scripts and test harnesses
+    driving the plugin host.
+
+    ``methods`` maps request names to callables, whose return value is the
+    response. Clients keep their connection open and may pipeline requests:
+    all the requests read at once are dispatched in order and their
+    responses written back together. The ``subscribe(childid)`` request
+    makes ``publish`` send the iopub messages of that child app to the
+    client as ``output`` notifications. A client that does not keep up
+    loses notifications beyond ``max_pending`` queued writes.
+    '''
+    def __init__(self, path, log, methods, max_pending=10000, max_request_size=64 * 1024 * 1024):
+        self.path = path
+        self.log = log
+        self.methods = dict(methods)
+        self.methods['subscribe'] = self._subscribe
+        self.methods['unsubscribe'] = self._unsubscribe
+        self.methods['ping'] = lambda *args: list(args)
+        self.max_pending = max_pending
+        self.max_request_size = max_request_size
+        self._connections = set()
+        # childid -> connections subscribed to it
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            # left over by a crashed session
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._sock.listen(16)
+        self._thread = threading.Thread(target=self._accept_loop, name='jupyter-nvim-control', daemon=True)
+        self._thread.start()
+        self.log.info('control server listening on %s', self.path)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                break
+            connection = _Connection(self, sock)
+            with self._lock:
+                self._connections.add(connection)
+            connection.start()
+
+    def remove(self, connection):
+        with self._lock:
+            if connection not in self._connections:
+                return False
+            self._connections.discard(connection)
+            for childid in connection.subscriptions:
+                subscribers = self._subscribers.get(childid)
+                if subscribers is not None:
+                    subscribers.discard(connection)
+                    if not subscribers:
+                        del self._subscribers[childid]
+        return True
+
+    def dispatch(self, connection, request):
+        try:
+            kind, msgid, method, params = request
+        except (TypeError, ValueError):
+            if isinstance(request, (list, tuple)) and request and request[0] == NOTIFICATION:
+                # notifications of the client are not answered
+                return None
+            self.log.warning('invalid control request %r', request)
+            return None
+        try:
+            func = self.methods[method]
+        except KeyError:
+            return pack([RESPONSE, msgid, ['KeyError', 'no method {}'.format(method)], None])
+        try:
+            if method in ('subscribe', 'unsubscribe'):
+                result = func(connection, *params)
+            else:
+                result = func(*params)
+        except Exception as ex:
+            self.log.exception('control request %s failed', method)
+            return pack([RESPONSE, msgid, [type(ex).__name__, str(ex)], None])
+        return pack([RESPONSE, msgid, None, result])
+
+    def _subscribe(self, connection, childid):
+        with self._lock:
+            connection.subscriptions.add(childid)
+            self._subscribers.setdefault(childid, set()).add(connection)
+        return True
+
+    def _unsubscribe(self, connection, childid):
+        with self._lock:
+            connection.subscriptions.discard(childid)
+            subscribers = self._subscribers.get(childid)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self._subscribers[childid]
+        return True
+
+    def subscribed(self, childid):
+        return childid in self._subscribers
+
+    def publish(self, childid, msg_type, content, parent_id=None, label=None):
+        subscribers = self._subscribers.get(childid)
+        if not subscribers:
+            return
+        # packed once for all the subscribers
+        data = pack([NOTIFICATION, 'output', [childid, msg_type, content, parent_id, label]])
+        for connection in list(subscribers):
+            connection.notify(data)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                # wakes up accept()
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,114 @@
+import threading
+from collections import deque, OrderedDict
+
+__all__ = (
+    'ExecutionScheduler',
+    'QueueFull',
+)
+
+class QueueFull(Exception):
+    pass
+
+class ExecutionScheduler():
+    '''Queue of execute requests of one child app.
+
+    At most ``max_inflight`` requests are sent to the kernel at a time, the
+    others wait in a queue bounded by ``max_queued``. Submitting code that
+    is already waiting in the queue with the same label is coalesced into
+    the waiting item: repeated unlabelled runs of a mapping are, two cells
+    with the same source are not.
+    ``send(code)`` sends the request and returns its msgid, ``done(msgid)``
+    must be called once the request is finished. ``send`` is called without
+    the lock held, since it may finish other requests and so call ``done``.
+    ``on_change(depth)`` is called whenever the queue depth changes.
+    '''
+    def __init__(self, send, log, max_queued=100, max_inflight=2, on_change=None):
+        self.send = send
+        self.log = log
+        self.max_queued = max_queued
+        self.max_inflight = max_inflight
+        self.on_change = on_change
+        # [code, label]
+        self._pending = deque()
+        # msgid -> label
+        self._inflight = OrderedDict()
+        # requests popped from the queue and being sent
+        self._sending = 0
+        # True while a thread sends the queued requests
+        self._pumping = False
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return len(self._pending) + self._sending + len(self._inflight)
+
+    def submit(self, code, label=None):
+        with self._lock:
+            for item in self._pending:
+                if item[0] == code and item[1] == label:
+                    self.log.info('coalesced execution of %s', label or 'duplicate code')
+                    return False
+            if len(self._pending) >= self.max_queued:
+                raise QueueFull('{} executions are already queued'.format(len(self._pending)))
+            self._pending.append([code, label])
+        self._pump()
+        self._changed()
+        return True
+
+    def done(self, msgid):
+        with self._lock:
+            if msgid not in self._inflight:
+                return None
+            label = self._inflight.pop(msgid)
+        self._pump()
+        self._changed()
+        return label
+
+    def inflight(self):
+        with self._lock:
+            return list(self._inflight)
+
+    def label(self, msgid):
+        with self._lock:
+            return self._inflight.get(msgid)
+
+    def cancel(self):
+        with self._lock:
+            count = len(self._pending)
+            self._pending.clear()
+        if count:
+            self._changed()
+        return count
+
+    def _pump(self):
+        # one thread at a time sends, so that the requests are sent in order.
+        # The others, and done called by send itself, leave the slots they
+        # free to that thread
+        with self._lock:
+            if self._pumping:
+                return
+            self._pumping = True
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending or self._sending + len(self._inflight) >= self.max_inflight:
+                        self._pumping = False
+                        return
+                    code, label = self._pending.popleft()
+                    self._sending += 1
+                msgid = None
+                try:
+                    msgid = self.send(code)
+                finally:
+                    with self._lock:
+                        self._sending -= 1
+                        if msgid is not None:
+                            self._inflight[msgid] = label
+        except BaseException:
+            with self._lock:
+                self._pumping = False
+            raise
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.depth)
@@ -0,0 +1,221 @@
+import collections
+import datetime
+import threading
+import time
+from dateutil.parser import isoparse
+
+__all__ = (
+    'AppStats',
+    'format_stats',
+)
+
+# iopub messages that are output of an execution
+_OUTPUT_TYPES = frozenset(('stream', 'execute_result', 'display_data', 'error'))
+
+def _timestamp(date):
+    # header dates are datetimes once deserialized by jupyter_client, but
+    # may still be strings
+    if date is None:
+        return None
+    if isinstance(date, str):
+        try:
+            date = isoparse(date)
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+class Rate():
+    '''Events per second over the last ``window`` seconds.'''
+    def __init__(self, window=10):
+        self.window = window
+        # [second, count] buckets, oldest first
+        self.buckets = collections.deque()
+
+    def add(self, count=1, now=None):
+        second = int(now if now is not None else time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([second, count])
+            while self.buckets[0][0] <= second - self.window:
+                self.buckets.popleft()
+
+    def rate(self, now=None):
+        now = now if now is not None else time.monotonic()
+        start = int(now) - self.window
+        return sum(count for second, count in self.buckets if second > start) / self.window
+
+class Timing():
+    '''Count, mean and max of durations in seconds, with percentiles of the
+    last ``samples`` ones.'''
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=samples)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent.append(seconds)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return None
+        recent = sorted(self.recent)
+        return recent[min(int(len(recent) * fraction), len(recent) - 1)]
+
+    def as_dict(self):
+        # milliseconds
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else None,
+            'p50_ms': _ms(self.percentile(0.5)),
+            'p95_ms': _ms(self.percentile(0.95)),
+            'max_ms': self.max * 1000,
+        }
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+class AppStats():
+    '''Instrumentation of one child app.
+
+    Messages are counted and rated per channel. For the executions of the
+    app, the latencies to the first output and to the idle status are
+    taken from the header dates, so they are measured by the kernel clock;
+    the transport delay is the time from the date of a message to its
+    handling here. Handler times are kept per (channel, msg_type), and the
+    calls queued to nvim with ``async_call`` are counted until they run.
+    '''
+    def __init__(self, window=10, samples=1000, max_pending=1000):
+        self.window = window
+        self.samples = samples
+        self.max_pending = max_pending
+        self.started = time.monotonic()
+        self.counts = collections.Counter()
+        self.rates = collections.defaultdict(lambda: Rate(window))
+        self.first_output = Timing(samples)
+        self.to_idle = Timing(samples)
+        self.transport = Timing(samples)
+        self.handlers = collections.defaultdict(lambda: Timing(samples))
+        self.rpc_queue = 0
+        self.rpc_queue_max = 0
+        self.rpc_wait = Timing(samples)
+        # msgid -> request date, until the first output
+        self._waiting_output = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def msg(self, channel, msg, own=False):
+        now = time.monotonic()
+        with self._lock:
+            self.counts[channel] += 1
+            self.counts['all'] += 1
+            self.rates[channel].add(now=now)
+            header = msg.get('header') or {}
+            date = _timestamp(header.get('date'))
+            if date is not None:
+                self.transport.add(max(time.time() - date, 0.0))
+            if not own or channel != 'iopub':
+                return
+            parent = msg.get('parent_header') or {}
+            if parent.get('msg_type') != 'execute_request':
+                return
+            msgid = parent.get('msg_id')
+            sent = _timestamp(parent.get('date'))
+            if date is None or sent is None:
+                return
+            msg_type = header.get('msg_type')
+            if msg_type == 'status':
+                state = msg['content'].get('execution_state')
+                if state == 'busy':
+                    self._waiting_output[msgid] = sent
+                    if len(self._waiting_output) > self.max_pending:
+                        self._waiting_output.popitem(last=False)
+                elif state == 'idle':
+                    self._waiting_output.pop(msgid, None)
+                    self.to_idle.add(max(date - sent, 0.0))
+            elif msg_type in _OUTPUT_TYPES and self._waiting_output.pop(msgid, None) is not None:
+                self.first_output.add(max(date - sent, 0.0))
+
+    def handler(self, channel, msg_type, seconds):
+        with self._lock:
+            self.handlers[channel, msg_type].add(seconds)
+
+    def async_call(self, nvim, fn, *args):
+        # nvim.async_call, counting the calls waiting for the nvim thread
+        queued = time.monotonic()
+        with self._lock:
+            self.rpc_queue += 1
+            if self.rpc_queue > self.rpc_queue_max:
+                self.rpc_queue_max = self.rpc_queue
+
+        def call():
+            with self._lock:
+                self.rpc_queue -= 1
+                self.rpc_wait.add(time.monotonic() - queued)
+            fn(*args)
+        nvim.async_call(call)
+
+    def as_dict(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'uptime': now - self.started,
+                'messages': dict(self.counts),
+                'rates': {channel: rate.rate(now) for channel, rate in self.rates.items()},
+                'latency': {
+                    'first_output': self.first_output.as_dict(),
+                    'idle': self.to_idle.as_dict(),
+                    'transport': self.transport.as_dict(),
+                },
+                'handlers': {'{}.{}'.format(*key): timing.as_dict()
+                             for key, timing in self.handlers.items()},
+                'rpc': {
+                    'queued': self.rpc_queue,
+                    'max_queued': self.rpc_queue_max,
+                    'wait': self.rpc_wait.as_dict(),
+                },
+            }
+
+def _format_timing(timing):
+    if not timing['count']:
+        return '-'
+    return '{count} x p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, max {max_ms:.1f} ms'.format(**timing)
+
+def format_stats(childid, stats):
+    '''Human readable lines of ``AppStats.as_dict()``.'''
+    lines = ['child app {}, up {:.0f} s'.format(childid, stats['uptime'])]
+    rates = stats['rates']
+    lines.append('messages: ' + ', '.join(
+        '{} {} ({:.1f}/s)'.format(channel, count, rates.get(channel, 0.0))
+        for channel, count in sorted(stats['messages'].items()) if channel != 'all'))
+    latency = stats['latency']
+    lines.append('kernel, execute to first output: ' + _format_timing(latency['first_output']))
+    lines.append('kernel, execute to idle: ' + _format_timing(latency['idle']))
+    lines.append('zmq, message date to handling: ' + _format_timing(latency['transport']))
+    rpc = stats['rpc']
+    lines.append('nvim, {} calls queued (max {}), wait: {}'.format(
+        rpc['queued'], rpc['max_queued'], _format_timing(rpc['wait'])))
+    requests = stats.get('requests')
+    if requests is not None:
+        lines.append('requests: {tracked} tracked, {completed} completed, {expired} expired, '
+                     '{cancelled} cancelled'.format(**requests))
+    throttle = stats.get('throttle')
+    if throttle is not None:
+        lines.append('output throttle ({policy}): {suppressed_lines} lines suppressed, '
+                     'blocked {blocked_seconds:.1f} s'.format(**throttle))
+    health = stats.get('health')
+    if health is not None:
+        rtt = '-' if health['srtt_ms'] is None else '{:.1f} ms +- {:.1f} ms'.format(
+            health['srtt_ms'], health['rttvar_ms'])
+        lines.append('heart beat: {state}, kernel {execution_state}, rtt {rtt}, timeout {timeout_ms:.0f} ms, '
+                     '{restarts} restarts'.format(rtt=rtt, **health))
+    handlers = sorted(stats['handlers'].items(), key=lambda item: -item[1]['mean_ms'] * item[1]['count'])
+    for key, timing in handlers:
+        lines.append('  handler {}: {}'.format(key, _format_timing(timing)))
+    return lines
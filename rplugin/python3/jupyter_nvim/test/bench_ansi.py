@@ -0,0 +1,23 @@
+# benchmark of the escape sequence stripping against the former SGR-only
+# regex, on a large colored IPython traceback and on plain text
+import re
+import timeit
+from jupyter_nvim.ansi import strip_ansi, ansi_highlights
+
+_control_seq = re.compile('\x1b\[[0-9;]+m')
+def legacy(string):
+    return re.sub(_control_seq, '', string)
+
+frame = ('\x1b[0;32m/home/user/project/module.py\x1b[0m in \x1b[0;36mrecurse\x1b[0;34m(n)\x1b[0m\n'
+         '\x1b[1;32m      3\x1b[0m \x1b[0;32mdef\x1b[0m recurse\x1b[0;34m(\x1b[0m\x1b[0mn\x1b[0m\x1b[0;34m)\x1b[0m\x1b[0;34m:\x1b[0m\n'
+         '\x1b[0;32m----> 4\x1b[0;31m     \x1b[0;32mreturn\x1b[0m recurse\x1b[0;34m(\x1b[0m\x1b[0mn\x1b[0m \x1b[0;34m+\x1b[0m \x1b[0;36m1\x1b[0m\x1b[0;34m)\x1b[0m\n')
+traceback = [frame] * 3000
+plain = [strip_ansi(line) for line in traceback]
+number = 20
+
+for name, lines in [('colored', traceback), ('plain', plain)]:
+    for label, func in [('legacy regex', lambda: [legacy(line) for line in lines]),
+                        ('strip_ansi', lambda: [strip_ansi(line) for line in lines]),
+                        ('ansi_highlights', lambda: ansi_highlights(lines))]:
+        seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print('{:8} {:16} {:8.2f} ms per traceback'.format(name, label, seconds * 1000))
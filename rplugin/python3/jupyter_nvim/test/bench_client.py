@@ -0,0 +1,105 @@
+# benchmark of the threaded and the asyncio kernel clients: starts 1, 10
+# and 50 kernels, connects one client per kernel and measures the latency
+# from execute_request to the idle status, the CPU time of this process
+# and its number of threads
+import sys
+import threading
+import time
+from jupyter_client import KernelManager
+from jupyter_client.threaded import ThreadedKernelClient, ThreadedZMQSocketChannel
+from traitlets import Type
+from jupyter_nvim.aioclient import AsyncioKernelClient
+
+class _Channel(ThreadedZMQSocketChannel):
+    handler = None
+
+    def call_handlers(self, msg):
+        if self.handler is not None:
+            self.handler(msg)
+
+class ThreadedClient(ThreadedKernelClient):
+    iopub_channel_class = Type(_Channel)
+    shell_channel_class = Type(_Channel)
+
+    def set_handlers(self, **handlers):
+        for name, handler in handlers.items():
+            getattr(self, name + '_channel').handler = handler
+
+class Collector():
+    def __init__(self):
+        self.sent = {}
+        self.latencies = []
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+
+    def iopub(self, msg):
+        parent = msg['parent_header'].get('msg_id')
+        if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+            with self.lock:
+                start = self.sent.pop(parent, None)
+                if start is not None:
+                    self.latencies.append(time.perf_counter() - start)
+                    self.done.notify()
+
+    def execute(self, client, code):
+        with self.lock:
+            msgid = client.execute(code)
+            self.sent[msgid] = time.perf_counter()
+
+    def wait(self, timeout=60):
+        with self.lock:
+            return self.done.wait_for(lambda: not self.sent, timeout)
+
+    def warm_up(self, client):
+        # the iopub subscription takes a while, until then messages are lost
+        for ii in range(30):
+            self.execute(client, 'pass')
+            if self.wait(1):
+                return
+            with self.lock:
+                self.sent.clear()
+        raise RuntimeError('kernel does not answer')
+
+def bench(managers, client_class, rounds=20):
+    collector = Collector()
+    clients = []
+    for km in managers:
+        km.client_factory = client_class
+        kc = km.client()
+        kc.start_channels(stdin=False)
+        kc.set_handlers(iopub=collector.iopub)
+        clients.append(kc)
+    for kc in clients:
+        collector.warm_up(kc)
+    collector.latencies.clear()
+    threads = threading.active_count()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for ii in range(rounds):
+        for kc in clients:
+            collector.execute(kc, 'print({})'.format(ii))
+        collector.wait()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    for kc in clients:
+        kc.stop_channels()
+    latencies = sorted(collector.latencies)
+    median = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return threads, median, p99, cpu / wall * 100
+
+counts = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50]
+managers = []
+try:
+    for count in counts:
+        while len(managers) < count:
+            km = KernelManager()
+            km.start_kernel()
+            managers.append(km)
+        for name, client_class in [('threaded', ThreadedClient), ('asyncio', AsyncioKernelClient)]:
+            threads, median, p99, cpu = bench(managers[:count], client_class)
+            print('{:3} kernels {:8} threads {:4} latency median {:7.2f} ms p99 {:7.2f} ms cpu {:5.1f}%'.format(
+                count, name, threads, median, p99, cpu))
+finally:
+    for km in managers:
+        km.shutdown_kernel(now=True)
@@ -0,0 +1,68 @@
+# per invocation cost of parsing the ':Jupyter' command lines: argparse, as
+# before, against JupyterCommand.parse with and without its cache. Checks
+# first that the fast path parses as argparse does
+import contextlib
+import io
+import logging
+import shlex
+import timeit
+from jupyter_nvim.command import JupyterCommand, _fast_parse
+
+command = JupyterCommand(None, logging.getLogger())
+lines = [
+    ['run'],
+    ['run --cells'],
+    ['execute -n 1 print(x)'],
+    ['stats --json'],
+]
+number = 20000
+
+def argparse_parse(cooked_args):
+    # the Namespace of argparse, None if it rejects the command line
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            args, unknown = command.parser.parse_known_args(cooked_args)
+            args.check_unknown(unknown)
+    except (Exception, SystemExit):
+        return None
+    return args
+
+equivalent = lines + [
+    ['run -n 1 -c'],
+    ['run -n -c'],
+    ['run --name=1'],
+    ['run -n'],
+    ['execute -n -c x'],
+    ['execute --cells x'],
+    ['run x'],
+]
+for raw_args in equivalent:
+    cooked_args = command.cook(raw_args, from_commandline=True)
+    fast = _fast_parse(cooked_args)
+    if fast is not None:
+        expected = argparse_parse(cooked_args)
+        assert expected is not None, raw_args
+        # check_unknown is another function, which ignores nothing either
+        fast.check_unknown = expected.check_unknown
+        assert vars(fast) == vars(expected), raw_args
+
+def argparse_only():
+    for raw_args in lines:
+        cooked_args = []
+        for arg in raw_args:
+            cooked_args.extend(shlex.split(arg))
+        args, unknown = command.parser.parse_known_args(cooked_args)
+        args.check_unknown(unknown)
+
+def uncached():
+    for raw_args in lines:
+        command._parsed.clear()
+        command.parse(command.cook(raw_args, from_commandline=True))
+
+def cached():
+    for raw_args in lines:
+        command.parse(command.cook(raw_args, from_commandline=True))
+
+for name, func in [('argparse', argparse_only), ('fast path', uncached), ('cached', cached)]:
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print('{:10} {:8.2f} us per command line'.format(name, seconds / number / len(lines) * 1e6))
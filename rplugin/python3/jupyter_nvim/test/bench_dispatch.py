@@ -0,0 +1,43 @@
+# micro benchmark of MsgHandler dispatch: the (channel, msg_type) table
+# against the former string concatenation + hasattr/getattr lookup
+import timeit
+from jupyter_nvim.handlers import MsgHandler, handle
+
+class LegacyHandler(MsgHandler):
+    def __call__(self, channel, msg, **kwargs):
+        msg_type = msg['header']['msg_type']
+        func_name = channel + '_' + msg_type
+
+        content = msg['content']
+        if hasattr(self, func_name):
+            getattr(self, func_name)(content, msg=msg, **kwargs)
+            return True
+        else:
+            return False
+
+class Handler(MsgHandler):
+    @handle('iopub', 'stream')
+    def iopub_stream(self, content, **kwargs):
+        pass
+
+    @handle('iopub', 'status')
+    def iopub_status(self, content, **kwargs):
+        pass
+
+class Legacy(LegacyHandler):
+    iopub_stream = Handler.iopub_stream
+    iopub_status = Handler.iopub_status
+
+msgs = [
+    ('iopub', {'header': {'msg_type': 'stream'}, 'content': {}}),
+    ('iopub', {'header': {'msg_type': 'status'}, 'content': {}}),
+    ('iopub', {'header': {'msg_type': 'comm_msg'}, 'content': {}}),
+]
+number = 200000
+
+for name, handler in [('legacy', Legacy(None, None)), ('table', Handler(None, None))]:
+    def run():
+        for channel, msg in msgs:
+            handler(channel, msg)
+    seconds = min(timeit.repeat(run, number=number, repeat=5))
+    print('{:8} {:10.0f} msgs/s'.format(name, number * len(msgs) / seconds))
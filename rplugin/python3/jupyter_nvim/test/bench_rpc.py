@@ -0,0 +1,64 @@
+# throughput of the control server: round trips, pipelined and batched
+# calls, and output notifications, against a stand-in kernel that answers
+# each submit with stream messages and an idle status
+import logging
+import os
+import tempfile
+import threading
+import time
+from jupyter_nvim.rpcserver import ControlServer
+from jupyter_nvim.rpcclient import ControlClient
+
+class StandInKernel():
+    def __init__(self, lines=10):
+        self.lines = lines
+        self.server = None
+        self.count = 0
+
+    def submit(self, childid, code, label=None):
+        self.count += 1
+        for ii in range(self.lines):
+            self.server.publish(childid, 'stream', {'name': 'stdout', 'text': '{} {}\n'.format(code, ii)},
+                                str(self.count), label)
+        self.server.publish(childid, 'status', {'execution_state': 'idle'}, str(self.count), label)
+        return True
+
+    def describe(self):
+        return {'1': {'current': True, 'queue_depth': 0, 'connection_file': ''}}
+
+def bench(name, count, func):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print('{:28} {:10.0f} /s'.format(name, count / seconds))
+
+kernel = StandInKernel()
+path = os.path.join(tempfile.mkdtemp(), 'control.sock')
+server = ControlServer(path, logging.getLogger(), {'submit': kernel.submit, 'list': kernel.describe})
+kernel.server = server
+server.start()
+client = ControlClient(path)
+
+number = 20000
+bench('ping, one at a time', number, lambda: [client.call('ping', ii) for ii in range(number)])
+bench('ping, pipelined', number, lambda: [future.result() for future in
+                                          [client.call_async('ping', ii) for ii in range(number)]])
+bench('ping, batches of 100', number, lambda: [client.batch([('ping', [ii])] * 100)
+                                               for ii in range(number // 100)])
+
+done = threading.Event()
+received = [0]
+def on_output(msg_type, content, parent_id, label):
+    received[0] += 1
+    if msg_type == 'status' and parent_id == str(kernel.count) and kernel.count == number:
+        done.set()
+client.subscribe('1', on_output)
+
+def submit_all():
+    client.batch([('submit', ['1', 'x = {}'.format(ii)]) for ii in range(number)])
+    done.wait(60)
+bench('submit + 11 notifications', number, submit_all)
+print('notifications received', received[0], 'of', number * (kernel.lines + 1))
+
+client.close()
+server.close()
@@ -0,0 +1,33 @@
+# import time guard of the remote plugin entry point: importing jupyter_nvim
+# must not load the jupyter stack, and must stay within the time budget
+import os
+import subprocess
+import sys
+
+budget_ms = 20
+heavy = ['jupyter_nvim.nvimapp', 'jupyter_nvim.command', 'jupyter_container',
+         'jupyter_client', 'traitlets', 'dateutil', 'zmq', 'tornado']
+
+rplugin = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+env = dict(os.environ, PYTHONPATH=rplugin)
+code = 'import sys, logging, neovim, jupyter_nvim; print(" ".join(m for m in {!r} if m in sys.modules))'.format(heavy)
+result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        universal_newlines=True, check=True)
+
+# import time: self [us] | cumulative | imported package
+cumulative = {}
+for line in result.stderr.splitlines():
+    if line.startswith('import time:') and '|' in line:
+        _, cum, name = line.split('|')
+        if cum.strip().isdigit():
+            cumulative[name.strip()] = int(cum)
+
+# neovim and logging are imported first, so what remains of jupyter_nvim
+# is our own cost
+spent_ms = cumulative.get('jupyter_nvim', 0) / 1000
+loaded = result.stdout.split()
+print('jupyter_nvim import: {:.1f} ms (budget {} ms), heavy modules loaded: {}'.format(
+    spent_ms, budget_ms, loaded or 'none'))
+assert not loaded, 'jupyter_nvim imports {} at startup'.format(loaded)
+assert spent_ms < budget_ms, 'jupyter_nvim import takes {:.1f} ms'.format(spent_ms)
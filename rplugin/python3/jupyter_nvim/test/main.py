@@ -18,7 +18,7 @@ appc = capp.JupyterContainerApp()
 appc.initialize([])
 
 app = napp.JupyterNvimApp()
-app.initialize([])
+app.initialize(['--history-file='])
 
 capp.JupyterContainerApp
 
@@ -0,0 +1,70 @@
+" drives the mappings and autocmds of plugin/jupyter.vim with stand-ins
+" for the remote functions, which record their arguments. Run from
+" the repository root:
+"   nvim --headless -u NONE -i NONE -S rplugin/python3/jupyter_nvim/test/mappings.vim
+" Failures are printed and make nvim exit with 1
+set nocompatible
+let s:calls = []
+function! Jupyter(...) abort
+  call add(s:calls, ['Jupyter'] + a:000)
+endfunction
+" the remote function writes the notebook and resets 'modified'
+function! JupyterNotebookSave(childid, bufno) abort
+  call add(s:calls, ['JupyterNotebookSave', a:childid, a:bufno])
+  call setbufvar(a:bufno, '&modified', 0)
+endfunction
+source plugin/jupyter.vim
+
+function! s:expect(expected, ...) abort
+  let l:name = a:0 ? a:1 : 'Jupyter'
+  if s:calls !=# [[l:name] + a:expected]
+    call add(v:errors, printf('expected %s(%s), got %s', l:name,
+          \ join(map(copy(a:expected), 'string(v:val)'), ', '), string(s:calls)))
+  endif
+  let s:calls = []
+endfunction
+
+" variable explorer: <cr> on a row of the list, then ]p, [p and -
+call JupyterShowVars('3', ['name  type  shape  dtype  size', 'df    DataFrame  10x2  int64  1K'], '', 0)
+normal! 2G
+exe "normal \<cr>"
+call s:expect(['vars', '-n', '3', 'df', '--page', '0'])
+call JupyterShowVars('3', ['row'], 'df', 0)
+normal ]p
+call s:expect(['vars', '-n', '3', 'df', '--page', '1'])
+call JupyterShowVars('3', ['row'], 'df', 1)
+normal [p
+call s:expect(['vars', '-n', '3', 'df', '--page', '0'])
+normal -
+call s:expect(['vars', '-n', '3'])
+bwipeout!
+
+" history: ]p and [p page with the same filters
+call JupyterShowHistory('4', ['# In [1]', 'x = 1'], {'query': ['x', 'y'], 'session': v:true, 'count': ''}, 0)
+normal ]p
+call s:expect(['history', '-n', '4', '--page', '1', '--session', 'x', 'y'])
+call JupyterShowHistory('4', [], {'query': [], 'session': v:false, 'count': 7}, 2)
+normal [p
+call s:expect(['history', '-n', '4', '--page', '1', '--count', '7'])
+bwipeout!
+
+" :w of a notebook buffer saves it through the sync JupyterNotebookSave
+exe 'edit' fnameescape('jupyter://notebook/' . tempname() . '.ipynb')
+setlocal buftype=acwrite noswapfile
+let b:jupyter_notebook_child = '2'
+call setline(1, ['# %%', 'x = 1'])
+write
+call s:expect(['2', bufnr('%')], 'JupyterNotebookSave')
+if &modified
+  call add(v:errors, 'the notebook buffer is still modified after :w')
+endif
+bwipeout!
+
+if empty(v:errors)
+  echo 'ok'
+  qall!
+endif
+for s:error in v:errors
+  echo s:error
+endfor
+cquit!
@@ -0,0 +1,49 @@
+# memory regression test of the request tracking: drives a million
+# synthetic shell/iopub messages through a child app and checks that the
+# memory held by the app does not grow with the number of messages
+import gc
+import tracemalloc
+import uuid
+import jupyter_nvim.nvimapp as napp
+import neovim
+
+nvim_socket = '/tmp/jupyter-nvim1'
+nvim = neovim.attach('socket', path=nvim_socket)
+
+app = napp.JupyterNvimApp()
+# no history, it would keep the synthetic executions
+app.initialize(nvim, ['--history-file='])
+bufapp = app.start_child_app(1, [])
+
+def header(msg_type, msgid=None):
+    return {'msg_type': msg_type, 'msg_id': msgid or uuid.uuid4().hex, 'date': None}
+
+def drive(count):
+    for ii in range(count):
+        msgid = uuid.uuid4().hex
+        bufapp.shell_send_callback('execute', msgid)
+        parent = header('execute_request', msgid)
+        bufapp.on_iopub_msg({'header': header('status'), 'parent_header': parent,
+                             'content': {'execution_state': 'busy'}})
+        bufapp.on_iopub_msg({'header': header('execute_input'), 'parent_header': parent,
+                             'content': {'code': 'x', 'execution_count': ii}})
+        if ii % 10:
+            # every tenth request loses its reply and has to expire
+            bufapp.on_shell_msg({'header': header('execute_reply'), 'parent_header': parent,
+                                 'content': {'status': 'ok'}})
+        bufapp.on_iopub_msg({'header': header('status'), 'parent_header': parent,
+                             'content': {'execution_state': 'idle'}})
+
+total = 1000000 // 4
+drive(10000)
+gc.collect()
+tracemalloc.start()
+before = tracemalloc.take_snapshot()
+drive(total)
+gc.collect()
+after = tracemalloc.take_snapshot()
+growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+print('messages: {}, growth: {} bytes, {}'.format(total * 4, growth, bufapp.tracker.stats))
+assert len(bufapp.tracker) <= bufapp.max_tracked_requests
+assert growth < 1024 * 1024, 'memory grows with the number of messages'
+app.quit()
@@ -13,7 +13,7 @@ nvim_socket = '/tmp/jupyter-nvim1'
 nvim = neovim.attach('socket', path=nvim_socket)
 
 app = napp.JupyterNvimApp()
-app.initialize(nvim, [])
+app.initialize(nvim, ['--history-file='])
 bufapp = app.start_child_app(1, ['-f=kernel-nvim-test.json'])
 bufapp.register_out_buffer(1, 2)
 
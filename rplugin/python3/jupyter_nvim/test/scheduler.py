@@ -0,0 +1,38 @@
+# deadlock regression test of the execution scheduler: the scheduler and
+# the request tracker are wired as in a child app, sending a request may
+# expire the oldest tracked ones, whose on_finish frees scheduler slots
+import logging
+import threading
+import uuid
+from jupyter_nvim.scheduler import ExecutionScheduler
+from jupyter_nvim.tracker import RequestTracker
+
+log = logging.getLogger()
+tracker = RequestTracker(max_size=10)
+
+def send(code):
+    msgid = uuid.uuid4().hex
+    tracker.add(msgid)
+    return msgid
+
+scheduler = ExecutionScheduler(send, log, max_queued=100, max_inflight=2)
+tracker.on_finish = lambda msgid, state: scheduler.done(msgid)
+
+# requests sent outside the scheduler, so that the tracker is full
+for ii in range(tracker.max_size):
+    tracker.add(uuid.uuid4().hex)
+
+def submit_all():
+    for ii in range(50):
+        scheduler.submit('x = {}'.format(ii))
+    # the replies of the running executions, done pumps the queued ones
+    while scheduler.inflight():
+        scheduler.done(scheduler.inflight()[0])
+
+thread = threading.Thread(target=submit_all, daemon=True)
+thread.start()
+thread.join(10)
+assert not thread.is_alive(), 'submit deadlocked'
+print('depth: {}, {}'.format(scheduler.depth, tracker.stats))
+assert scheduler.depth == 0
+assert len(tracker) <= tracker.max_size
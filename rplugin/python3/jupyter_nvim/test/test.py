@@ -11,7 +11,7 @@ from tornado import gen, ioloop
 
 
 app = napp.JupyterNvimApp()
-app.initialize([])
+app.initialize(['--history-file='])
 # print(app.subcommand, app.subapp, app.generate_config)
 
 # capp.JupyterContainerApp
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+__all__ = (
+    'OutputThrottle',
+)
+
+BLOCK = 'block'
+DROP = 'drop'
+FILE = 'file'
+
+def _count_lines(text):
+    return text.count('\n') or 1
+
+class OutputThrottle():
+    '''Token bucket limiting the stream output written to the buffers to
+    ``rate`` lines per second, with bursts of up to ``burst`` lines.
+
+    When the bucket is empty, the ``policy`` decides what happens to the
+    stream text:
+
+    * block: wait for the tokens, holding back the thread of the kernel
+      client, and so the kernel once zmq's buffers are full
+    * drop: suppress it, and keep only its last ``tail`` lines
+    * file: append it to a file
+
+    Suppressed text is not admitted again until the bucket is half full.
+    ``release`` then returns the "[N lines elided]" marker and the kept tail
+    to write before the next output. Only stream text goes through the
+    throttle, execute results and errors are always written.
+    '''
+    def __init__(self, rate=2000, burst=10000, policy=DROP, tail=20, prefix='jupyter-nvim-output-'):
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy
+        self.tail = tail
+        self.prefix = prefix
+        self.path = None
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        # lines suppressed since the last release, and in total
+        self.suppressed = 0
+        self.total_suppressed = 0
+        self.blocked = 0.0
+        # (name, text) of the last suppressed chunks, and their line count
+        self._tail = deque()
+        self._tail_lines = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'suppressed_lines': self.total_suppressed,
+            'blocked_seconds': self.blocked,
+            'file': self.path,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def admit(self, name, text):
+        # returns True if the text may be written, False if it is suppressed
+        count = _count_lines(text)
+        if self.policy == BLOCK:
+            with self._lock:
+                self._refill()
+                wait = (min(count, self.burst) - self.tokens) / self.rate
+                self.tokens -= count
+            if wait > 0:
+                self.blocked += wait
+                time.sleep(wait)
+            return True
+        with self._lock:
+            self._refill()
+            threshold = self.burst / 2 if self.suppressed else 0
+            if self.tokens >= max(count, threshold):
+                self.tokens -= count
+                return True
+            self.suppressed += count
+            self.total_suppressed += count
+            if self.policy == FILE:
+                self._write_file(text)
+            else:
+                self._keep_tail(name, text)
+            return False
+
+    def _keep_tail(self, name, text):
+        self._tail.append((name, text))
+        self._tail_lines += _count_lines(text)
+        while len(self._tail) > 1 and self._tail_lines - _count_lines(self._tail[0][1]) >= self.tail:
+            self._tail_lines -= _count_lines(self._tail.popleft()[1])
+
+    def _write_file(self, text):
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(prefix=self.prefix, suffix='.txt')
+            os.close(fd)
+        with open(self.path, 'a') as f:
+            f.write(text)
+
+    def release(self):
+        '''Returns (marker, tail) if text was suppressed since the last call,
+        None otherwise. tail is a list of (name, text).'''
+        with self._lock:
+            if not self.suppressed:
+                return None
+            suppressed, self.suppressed = self.suppressed, 0
+            if self.policy == FILE:
+                return '[{} lines written to {}]'.format(suppressed, self.path), []
+            tail = list(self._tail)
+            self._tail.clear()
+            self._tail_lines = 0
+        if tail:
+            # cut the oldest chunk down to the lines that fit in the tail
+            name, text = tail[0]
+            lines = text.split('\n')
+            excess = sum(_count_lines(chunk) for _, chunk in tail) - self.tail
+            if excess > 0:
+                tail[0] = (name, '\n'.join(lines[excess:]))
+        kept = sum(_count_lines(text) for _, text in tail)
+        return '[{} lines elided]'.format(max(suppressed - kept, 0)), tail
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = (
+    'RequestTracker',
+)
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'
+
+_REPLY = 1
+_IDLE = 2
+_DONE = _REPLY | _IDLE
+
+class RequestTracker():
+    '''Track the requests sent on the shell channel until they finish.
+
+    A request is completed when both its reply and the idle status of its
+    execution have arrived. Requests older than ``ttl`` seconds, or the
+    oldest ones once more than ``max_size`` are tracked, expire instead.
+    ``cancel`` stops tracking a request whose reply is no longer wanted.
+    ``on_finish(msgid, state)`` is called for completed, expired and
+    cancelled requests. The states of the last ``max_recent`` finished requests are
+    kept for ``state``.
+    '''
+    def __init__(self, ttl=600, max_size=1000, max_recent=100, on_finish=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_recent = max_recent
+        self.on_finish = on_finish
+        # msgid -> [send time, flags, execution_count], in the order of sending
+        self._requests = OrderedDict()
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.expired = 0
+        self.cancelled = 0
+
+    def __contains__(self, msgid):
+        return msgid in self._requests
+
+    def __len__(self):
+        return len(self._requests)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked': len(self._requests),
+                'completed': self.completed,
+                'expired': self.expired,
+                'cancelled': self.cancelled,
+            }
+
+    def add(self, msgid):
+        with self._lock:
+            self._requests[msgid] = [time.monotonic(), 0, None]
+            finished = self._expire()
+        self._notify(finished)
+
+    def reply(self, msgid):
+        return self._mark(msgid, _REPLY)
+
+    def idle(self, msgid):
+        return self._mark(msgid, _IDLE)
+
+    def set_execution_count(self, msgid, execution_count):
+        request = self._requests.get(msgid)
+        if request is not None:
+            request[2] = execution_count
+
+    def execution_count(self, msgid):
+        request = self._requests.get(msgid)
+        if request is not None:
+            return request[2]
+
+    def state(self, msgid):
+        if msgid in self._requests:
+            return PENDING
+        return self._recent.get(msgid)
+
+    def cancel(self, msgid):
+        with self._lock:
+            if self._requests.pop(msgid, None) is None:
+                return False
+            self._finish(msgid, CANCELLED)
+        self._notify([(msgid, CANCELLED)])
+        return True
+
+    def expire(self):
+        with self._lock:
+            finished = self._expire()
+        self._notify(finished)
+
+    def _mark(self, msgid, flag):
+        # returns True if the request is completed by this message
+        with self._lock:
+            request = self._requests.get(msgid)
+            if request is None:
+                return False
+            request[1] |= flag
+            done = request[1] == _DONE
+            if done:
+                del self._requests[msgid]
+                self._finish(msgid, COMPLETED)
+            finished = self._expire()
+        if done:
+            finished.insert(0, (msgid, COMPLETED))
+        self._notify(finished)
+        return done
+
+    def _expire(self):
+        # called with the lock held. The requests are ordered by send time,
+        # so only the oldest ones need to be checked
+        finished = []
+        deadline = time.monotonic() - self.ttl
+        while self._requests:
+            msgid, request = next(iter(self._requests.items()))
+            if request[0] > deadline and len(self._requests) <= self.max_size:
+                break
+            del self._requests[msgid]
+            self._finish(msgid, EXPIRED)
+            finished.append((msgid, EXPIRED))
+        return finished
+
+    def _finish(self, msgid, state):
+        if state == COMPLETED:
+            self.completed += 1
+        elif state == CANCELLED:
+            self.cancelled += 1
+        else:
+            self.expired += 1
+        self._recent[msgid] = state
+        if len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    def _notify(self, finished):
+        if self.on_finish is not None:
+            for msgid, state in finished:
+                self.on_finish(msgid, state)
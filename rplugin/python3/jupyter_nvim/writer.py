@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+__all__ = (
+    'BufferWriter',
+    'SpillFile',
+)
+
+class SpillFile():
+    '''Append-only file collecting the lines trimmed from output buffers.'''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.path = None
+        self.lines = 0
+
+    def write(self, bufno, lines):
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(prefix=self.prefix, suffix='.txt')
+            os.close(fd)
+        with open(self.path, 'a') as f:
+            print('### buffer {}, {} lines trimmed at {}'.format(
+                bufno, len(lines), time.strftime('%Y-%m-%d %H:%M:%S')), file=f)
+            for line in lines:
+                print(line, file=f)
+        self.lines += len(lines)
+
+class _BufState():
+    def __init__(self, buf, line_count, max_lines):
+        self.buf = buf
+        self.line_count = line_count
+        self.max_lines = max_lines
+        # line offsets where the cells written to the buffer start
+        self.cells = []
+        # whether the last line of the buffer is an open line that the
+        # next flush may replace
+        self.open = False
+
+    def take_trim(self):
+        if not self.max_lines or self.line_count <= self.max_lines:
+            return 0
+        # trim down to 3/4 of the cap so that we do not trim on every flush,
+        # at the first cell boundary that gets there, if any
+        trim = self.line_count - self.max_lines * 3 // 4
+        for start in self.cells:
+            if start >= trim:
+                trim = start
+                break
+        self.line_count -= trim
+        self.cells = [start - trim for start in self.cells if start >= trim]
+        return trim
+
+class BufferWriter():
+    '''Collect output lines and flush them to every buffer in ``bufs``.
+
+    Each flush sends one immutable block of lines to all the buffers with a
+    single ``nvim_exec_lua`` call of ``jupyter_nvim.deliver``
+    (lua/jupyter_nvim.lua), so mirroring the output to N buffers costs
+    about as much as writing it to one.
+
+    A flush happens when ``flush_lines`` lines are pending, ``flush_interval``
+    seconds after the first pending line, or when ``flush`` is called.
+    Buffers added with ``max_lines`` have their oldest cells trimmed into
+    ``spill`` once they grow beyond the cap.
+
+    Lines written with an ``owner`` and ``partial=True`` leave the last line
+    open: the next write of the same owner replaces that line in place,
+    either in the pending lines or, if it has been flushed, in the buffers.
+
+    ``write_future`` reserves the place of lines that are still being
+    rendered: later writes wait behind it until the future is done.
+
+    ``highlights`` of a write are ``(row, start_col, end_col, group)`` with
+    rows relative to the written lines. They are added as extmarks right
+    after the lines are set.
+    '''
+    def __init__(self, nvim, log, bufs, flush_interval=0.05, flush_lines=1000, spill=None,
+                 async_call=None):
+        self.nvim = nvim
+        self.async_call = async_call or nvim.async_call
+        self.log = log
+        self.bufs = bufs
+        self.flush_interval = flush_interval
+        self.flush_lines = flush_lines
+        self.spill = spill
+        self._states = {}
+        self._lines = []
+        self._cells = []
+        # (row in the pending lines, start_col, end_col, group)
+        self._highlights = []
+        # the pending lines start with the new content of the open line
+        self._replace = False
+        # owner of the open line, None if the last line is complete. open
+        # includes the writes waiting behind futures, _open does not
+        self.open = None
+        self._open = None
+        # futures and the writes queued behind the oldest unfinished future
+        self._waiting = deque()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add_buffer(self, buf, max_lines=None):
+        # len(buf) is a synchronous request, call this from the nvim thread
+        with self._lock:
+            if buf in self._states:
+                self._states[buf].max_lines = max_lines
+                return
+            self._states[buf] = _BufState(buf, len(buf), max_lines)
+            self.bufs.append(buf)
+
+    def remove_buffer(self, bufno):
+        with self._lock:
+            for buf in list(self.bufs):
+                if buf.number == bufno:
+                    self.bufs.remove(buf)
+                    del self._states[buf]
+
+    def write(self, lines, cell=False, owner=None, partial=False, highlights=None):
+        with self._lock:
+            self.open = owner if partial else None
+            if self._waiting:
+                self._waiting.append((lines, cell, owner, partial, highlights))
+                return
+            self._write(lines, cell, owner, partial, highlights)
+            self._schedule()
+
+    def write_future(self, future, cell=False):
+        # the result of the future is the list of lines to write
+        with self._lock:
+            self.open = None
+            self._waiting.append((future, cell))
+        future.add_done_callback(self._future_done)
+
+    def _future_done(self, future):
+        with self._lock:
+            while self._waiting:
+                item = self._waiting[0]
+                if len(item) == 2:
+                    if not item[0].done():
+                        break
+                    try:
+                        lines = item[0].result()
+                    except Exception as ex:
+                        self.log.exception('failed to render output')
+                        lines = ['[failed to render output: {}]'.format(ex)]
+                    self._write(lines, item[1], None, False, None)
+                else:
+                    self._write(*item)
+                self._waiting.popleft()
+            self._schedule()
+
+    def _write(self, lines, cell, owner, partial, highlights):
+        first = len(self._lines)
+        if lines and owner is not None and owner == self._open:
+            if self._lines:
+                self._lines[-1] = lines[0]
+            else:
+                self._lines.append(lines[0])
+                self._replace = True
+            first = len(self._lines) - 1
+            lines = lines[1:]
+        if highlights:
+            self._highlights.extend((first + row, start, end, group)
+                                    for row, start, end, group in highlights)
+        if cell:
+            self._cells.append(len(self._lines))
+        self._lines.extend(lines)
+        self._open = owner if partial else None
+
+    def _schedule(self):
+        if len(self._lines) < self.flush_lines and self.flush_interval > 0:
+            if self._timer is None and self._lines:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return
+        self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # called with the lock held, so that the async calls are queued in
+        # the same order as the lines were written
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        lines, self._lines = self._lines, []
+        cells, self._cells = self._cells, []
+        replace, self._replace = self._replace, False
+        highlights, self._highlights = self._highlights, []
+        if not lines or not self.bufs:
+            return
+        targets = []
+        for buf in self.bufs:
+            state = self._states[buf]
+            start = -2 if replace and state.open else -1
+            base = state.line_count + start + 1
+            state.cells.extend(base + ii for ii in cells)
+            state.line_count = base + len(lines)
+            state.open = self._open is not None
+            targets.append((buf, start, base, state.take_trim()))
+        self.async_call(self._deliver, tuple(lines), targets, highlights)
+
+    def _deliver(self, lines, targets, highlights):
+        try:
+            trimmed = self.nvim.exec_lua("return require('jupyter_nvim').deliver(...)",
+                                         lines, targets, highlights)
+        except Exception as ex:
+            self.log.warning('failed to write to buffers %s: %s',
+                             [buf.number for buf, _, _, _ in targets], ex)
+            return
+        if self.spill is not None:
+            for bufno, lines in trimmed:
+                self.spill.write(bufno, lines)